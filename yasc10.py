@@ -28,18 +28,24 @@
 
 
 import pygame
+import numpy as np
+import argparse
 import random
 import colorsys
-from collections import deque
+from collections import deque, OrderedDict
+import heapq
+from collections.abc import Set
 import string
+import sys
 import time
-import pickle
+import struct
+from array import array
+import threading
 import os
-
-# Initialize Pygame
-pygame.init()
-pygame.font.init()
-territories = {}
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 # PLAYFIELD_SIZE = 100
 TILE_SIZE = 11
@@ -47,22 +53,31 @@ ORIGINAL_RADAR_SIZE = 262
 RADAR_SIZE = ORIGINAL_RADAR_SIZE
 RADAR_SHRINK = 19
 SHRUNKEN_RADAR_SIZE = RADAR_SIZE - RADAR_SHRINK
-frame_counter = 0
 
-def generate_unique_colors(n):
+def generate_unique_colors(n, rng=random):
     colors = set()
     golden_ratio_conjugate = 0.618033988749895
-    hue = random.random()
+    hue = rng.random()
+    # One saturation / value pair only has about a thousand distinct colors; when the hue keeps hitting
+    # used ones, move on to the next pair
+    shades = [(0.8, 0.8)] + [(s, v) for s in (0.6, 1.0, 0.45) for v in (0.95, 0.65, 0.8, 0.5)]
+    shade = 0
     
     for _ in range(n):
         hue += golden_ratio_conjugate
         hue %= 1
-        rgb = colorsys.hsv_to_rgb(hue, 0.8, 0.8)
+        rgb = colorsys.hsv_to_rgb(hue, *shades[shade])
         color = tuple(int(c * 255) for c in rgb)
+        misses = 0
         while color in colors:
+            misses += 1
+            if misses % 64 == 0:
+                if shade == len(shades) - 1:
+                    break  # Every shade is used up, allow a repeat
+                shade += 1
             hue += golden_ratio_conjugate
             hue %= 1
-            rgb = colorsys.hsv_to_rgb(hue, 0.8, 0.8)
+            rgb = colorsys.hsv_to_rgb(hue, *shades[shade])
             color = tuple(int(c * 255) for c in rgb)
         colors.add(color)
     
@@ -70,11 +85,12 @@ def generate_unique_colors(n):
 
 
 NUM_BOTS = 40
-BOT_COLORS = generate_unique_colors(NUM_BOTS)
-# print(f"Generated {len(BOT_COLORS)} unique colors")
 
 NUM_ENTITIES = NUM_BOTS +1
 MIN_SPAWN_DISTANCE = 9
+SPAWN_BORDER = 3  # Spawn positions keep this many cells from the edge of the map
+SPAWN_ATTEMPTS = 16  # Blocks looked into per stage of find_valid_spawn_position, at most
+SPAWN_CANDIDATES = 16  # Blocks compared on a map too crowded for a clear block
 # MIN_AREA = (NUM_ENTITIES * (MIN_SPAWN_DISTANCE ** 2) * 4) // 3  # Adding some extra space
 MIN_AREA = 120 ** 2
 NEW_GRID_SIZE = int(MIN_AREA ** 0.5) + 1
@@ -91,6 +107,38 @@ BOT_VS_BOT_AGGRESSION = 0.0  # 0.5  # Default value, range 0-1
 BOT_VS_PLAYER_AGGRESSION = 1.0 # 0.7  # Default value, range 0-1
 PLAYER_PROXIMITY_FACTOR = 3.0   # 1.2  # Multiplier for aggression when near player
 PROXIMITY_THRESHOLD = 15  # 30  # Distance to player to trigger increased aggression
+# AI level of detail: bots farther than LOD_RADIUS tiles (along either axis) from the player, i.e. half a viewport
+# beyond its edge, run a cheap policy that only picks a new direction every LOD_INTERVAL ticks
+LOD_RADIUS = VIEWPORT_TILES
+LOD_INTERVAL = 4
+LOD_TURN_CHANCE = 0.5  # Chance that a far bot turns at one of those decisions instead of going on straight
+
+SPATIAL_CELL_SIZE = 8  # Bucket size (in tiles) of the spatial hash used for entity proximity queries
+TRAIL_FIELD_RADIUS = 5  # How far (in tiles) the per-step tactical field looks for enemy trails
+HEAD_FIELD_RADIUS = 20  # ... and for enemy heads
+CHUNK_BITS = 6
+CHUNK_SIZE = 1 << CHUNK_BITS  # Ownership and trails are stored in CHUNK_SIZE x CHUNK_SIZE chunks, allocated on first write
+CHUNK_MASK = CHUNK_SIZE - 1
+SPAWN_BLOCK_BITS = 3
+SPAWN_BLOCK = 1 << SPAWN_BLOCK_BITS  # Chunked arrays also count their non-zero cells per SPAWN_BLOCK x SPAWN_BLOCK block
+CHANGE_LOG_LIMIT = 16384  # Changed cells the renderer is told about individually before it redraws everything
+MAX_CACHED_CHUNKS = 16  # Pre-rendered chunk surfaces the viewport renderer keeps (a 64x64 chunk is ~2 MB)
+PATH_NODE_BUDGET = 600  # Max. cells a bot's path search may expand before it settles for a partial path
+# What a bot's cached path leads to, and how far (Manhattan) a new target of that kind may be from the cached path's
+# target for the path to be followed on instead of searching again; random expansion targets are all as good
+PATH_SLACK = {'home': 4, 'player': 4, 'expand': 10}
+PATH_GOALS = tuple(PATH_SLACK)  # Stored by index in saves
+HOME_FIELD_BLOCK = 32  # Block size (in tiles) of the windows bots keep their home distance field over
+HOME_FIELD_CACHE = 64  # Home fields kept per world, the least recently used one goes first
+
+# Timing
+TICK_RATE = 15  # Simulation ticks per second; every tick moves every entity by one tile
+FRAME_RATE = 30  # Render frames per second (upper bound)
+MAX_CATCH_UP_TIME = 1 / 30  # Wall time a frame may spend on catch-up ticks before it draws again
+MAX_TICK_BACKLOG = 0.25  # Seconds of missed ticks kept; anything older is dropped and the game slows down
+MAX_SKIPPED_FRAMES = 4  # Frames that may be skipped in a row while the simulation is behind
+PROFILE_WINDOW = 300  # Samples kept per profiled phase or method
+PROFILE_HUD_REFRESH = 0.5  # Seconds between redraws of the profiler overlay
 
 # Colors
 BACKGROUND_COLOR = (40, 40, 40)
@@ -101,159 +149,1323 @@ PLAYER_TERRITORY_COLOR = (0, 60, 0)
 TRAIL_COLOR = (0, 120, 0)
 RADAR_BACKGROUND_COLOR = (0, 40, 0)
 RADAR_TERRITORY_COLOR = (0, 90, 0)
+RADAR_REFRESH_FRAMES = 5  # Rebuild the radar image every N frames
+RADAR_OWNER_COLORS = False  # Draw each entity's territory in its own color on the radar
 GREEN_100 = (0, 100, 0)
 
-game_started = False
-game_paused = False
+# Player input values accepted by Simulation.step()
+PLAYER_STOP = "stop"
+# One-letter codes for the inputs in a recording
+INPUT_CODES = {(0, -1): "U", (0, 1): "D", (-1, 0): "L", (1, 0): "R", PLAYER_STOP: "S"}
+RECORDING_VERSION = 1
+SAVE_FILE = "savegame.yasc"
+AUTOSAVE_FILE = "autosave.yasc"
+AUTOSAVE_INTERVAL = 60  # Seconds of game time between two autosaves, 0 = off
+SAVE_MAGIC = b"YASC"
+SAVE_VERSION = 2
+# grid size, bots, seed, tick, last entity id, bot color index, bot name letter and number, game over,
+# has input log, then the world generator's version and gauss_next (NaN for None)
+SAVE_HEADER = '<IIQIIIIIBBId'
+# Bot attributes saved as they are, on top of what every entity has
+BOT_STATE_FIELDS = ('rng_seed', 'change_direction_threshold', 'trail_check_counter', 'trail_check_threshold',
+                    'trail_check_distance', 'max_trail_length', 'aggression', 'base_aggression')
+ENTITY_RECORD = np.dtype([
+    ('id', '<i4'), ('is_bot', 'u1'), ('x', '<i4'), ('y', '<i4'), ('color', 'u1', 3), ('moving', 'u1'),
+    ('has_direction', 'u1'), ('direction', 'i1', 2), ('has_last_direction', 'u1'), ('last_direction', 'i1', 2),
+    ('change_direction_counter', '<i4'), ('trail_length', '<u4'),
+    ('rng_seed', '<u8'), ('change_direction_threshold', '<i4'), ('trail_check_counter', '<i4'),
+    ('trail_check_threshold', '<i4'), ('trail_check_distance', '<i4'), ('max_trail_length', '<i4'),
+    ('aggression', '<f8'), ('base_aggression', '<f8'),
+    ('path_goal', 'u1'), ('path_target', '<i4', 2), ('path_length', '<i4'),  # path_length -1 = no cached path
+])
+
 last_score_update_time = 0
 cached_score_surface = None
 last_scores = {}
 
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("YASC - Yet Another Splix Clone v1.0")
-
-
-def save_game(player, bots, score_manager, territories, filename="savegame.pkl"):
-    game_state = {
-        'player': {
-            'position': (player.x, player.y),
-            'trail': player.trail,
-            'territory': player.territory,
-            'color': player.color,
-            'name': player.name,
-            'id': player.id
-        },
-        'bots': [{
-            'position': (bot.x, bot.y),
-            'trail': bot.trail,
-            'territory': bot.territory,
-            'color': bot.color,
-            'name': bot.name,
-            'id': bot.id
-        } for bot in bots],
-        'scores': score_manager.scores,
-        'territories': {entity.name: territory for entity, territory in territories.items()}
-    }
-    
-    with open(filename, 'wb') as f:
-        pickle.dump(game_state, f)
+
+def snapshot_game(sim):
+    # Copies everything a save needs out of the live world, cheap enough to be done between two ticks:
+    #   header, world generator state
+    #   ownership and trail grid: keys and cells of their non-empty chunks
+    #   entity table (ENTITY_RECORD) and names, every trail and cached path
+    #   as coordinates, scores, the input log
+    # Encoding and writing the snapshot is left to write_save(), which may run on another thread
+    chunk_xs, chunk_ys, blocks = sim.ownership.owner.copy_chunks()
+    entities = sim.all_entities
+    rows, trail_cells, path_cells = [], [], []
+    for entity in entities:
+        # In ENTITY_RECORD order; the table itself is built by write_save()
+        bot = isinstance(entity, Bot)
+        path_goal, path_target, path_length = 0, (0, 0), -1
+        if bot and entity.path_cache is not None:
+            goal, path_target, path = entity.path_cache
+            path_goal, path_length = PATH_GOALS.index(goal), len(path)
+            path_cells += path
+        rows.append((entity.id, bot, entity.x, entity.y, entity.color, entity.moving,
+                     entity.direction is not None, entity.direction or (0, 0),
+                     entity.last_direction is not None, entity.last_direction or (0, 0),
+                     entity.change_direction_counter, len(entity.trail))
+                    + (tuple(getattr(entity, field) for field in BOT_STATE_FIELDS) if bot else (0,) * len(BOT_STATE_FIELDS))
+                    + (path_goal, path_target, path_length))
+        trail_cells += entity.trail
+
+    rng_version, rng_internal, rng_gauss = sim.rng.getstate()
+    header = struct.pack(SAVE_HEADER, sim.grid_size, sim.num_bots, sim.seed, sim.tick_count, sim.last_entity_id,
+                         sim.bot_color_index, sim.score_manager.current_letter_index, sim.score_manager.current_number,
+                         sim.game_over, sim.input_log is not None, rng_version,
+                         float('nan') if rng_gauss is None else rng_gauss)
+    score_names, score_values = list(sim.score_manager.scores), list(sim.score_manager.scores.values())
+    input_log = sim.input_log or []
+    arrays = [
+        np.array(rng_internal, dtype=np.uint32),
+        chunk_xs.astype(np.int32), chunk_ys.astype(np.int32), blocks.ravel(), sim.trails.owner.copy_chunks(),
+        rows, [entity.name for entity in entities], trail_cells, path_cells,
+        encode_names(score_names), np.array(score_values, dtype=np.int64),
+        np.array([tick for tick, _ in input_log], dtype=np.int32), encode_names(code for _, code in input_log),
+    ]
+    return header, arrays
+
+
+def write_save(snapshot, filename=SAVE_FILE):
+    # The ownership cells are run-length encoded and the payload is zlib-compressed behind a magic number
+    # and a version. The file is written next to its destination and renamed over it, so an interrupted
+    # save never leaves a truncated file behind
+    header, arrays = snapshot
+    cells = arrays[3]
+    trail_cxs, trail_cys, trail_blocks = arrays[4]
+    k, lx, ly = np.nonzero(trail_blocks)
+    trail_xs, trail_ys = trail_cxs[k] * CHUNK_SIZE + lx, trail_cys[k] * CHUNK_SIZE + ly
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(cells)) + 1)) if len(cells) else np.zeros(0, dtype=np.intp)
+    run_lengths = np.diff(np.append(run_starts, len(cells)))
+    rows, names, trail_cells, path_cells = arrays[5:9]
+    arrays = (arrays[:3] + [cells[run_starts], run_lengths.astype(np.uint32)]
+              + [trail_xs.astype(np.int32), trail_ys.astype(np.int32), trail_blocks[k, lx, ly]]
+              + [np.array(rows, dtype=ENTITY_RECORD), encode_names(names),
+                 np.array(trail_cells, dtype=np.int32).reshape(-1, 2), np.array(path_cells, dtype=np.int32).reshape(-1, 2)]
+              + arrays[9:])
+    payload = header + b''.join(struct.pack('<Q', array.nbytes) + array.tobytes() for array in arrays)
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, 'wb') as f:
+        f.write(SAVE_MAGIC + struct.pack('<H', SAVE_VERSION) + zlib.compress(payload, 6))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+
+def save_game(sim, filename=SAVE_FILE):
+    write_save(snapshot_game(sim), filename)
     print(f"Game saved to {filename}")
 
 
-def load_game(filename="savegame.pkl"):
+class BackgroundSaver:
+    # Saves without stalling the game: the snapshot is taken on the main thread between two ticks, encoding
+    # and writing it happen on a worker thread. Autosaves every `interval` ticks (0 = never); an autosave that
+    # comes due while the previous save is still being written is put off to the next tick
+    def __init__(self, filename=AUTOSAVE_FILE, interval=0):
+        self.filename = filename
+        self.interval = interval
+        self.last_tick = None
+        self.thread = None
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def save(self, sim, filename=None):
+        self.wait()
+        self.last_tick = sim.tick_count
+        snapshot = snapshot_game(sim)
+        self.thread = threading.Thread(target=self.write, args=(snapshot, filename or self.filename), daemon=True)
+        self.thread.start()
+
+    def write(self, snapshot, filename):
+        try:
+            write_save(snapshot, filename)
+            print(f"Game saved to {filename}")
+        except OSError as e:
+            print(f"Saving to {filename} failed: {e}")
+
+    def update(self, sim):
+        if self.last_tick is None or sim.tick_count < self.last_tick:
+            self.last_tick = sim.tick_count  # New or just loaded game
+        if self.interval and sim.tick_count - self.last_tick >= self.interval and not self.busy():
+            self.save(sim)
+
+
+def encode_names(names):
+    return np.frombuffer('\n'.join(names).encode(), dtype=np.uint8)
+
+
+def decode_names(data):
+    text = data.tobytes().decode()
+    return text.split('\n') if text else []
+
+
+def load_game(filename=SAVE_FILE):
     if not os.path.exists(filename):
         print(f"Save file {filename} not found.")
         return None
 
     with open(filename, 'rb') as f:
-        game_state = pickle.load(f)
-    
-    # Recreate player
-    player_data = game_state['player']
-    player = Player(player_data['position'][0], player_data['position'][1], player_data['color'])
-    player.trail = player_data['trail']
-    player.territory = player_data['territory']
-    player.name = player_data['name']
-    player.id = player_data['id']
-
-    # Recreate bots
-    bots = []
-    for bot_data in game_state['bots']:
-        bot = Bot(bot_data['position'][0], bot_data['position'][1])
-        bot.trail = bot_data['trail']
-        bot.territory = bot_data['territory']
-        bot.color = bot_data['color']
-        bot.name = bot_data['name']
-        bot.id = bot_data['id']
-        bots.append(bot)
-
-    # Recreate score manager
-    score_manager = ScoreManager()
-    score_manager.scores = game_state['scores']
-
-    # Recreate territories
-    territories = {next((e for e in [player] + bots if e.name == name), name): territory 
-                   for name, territory in game_state['territories'].items()}
+        data = f.read()
+    prefix = len(SAVE_MAGIC) + 2
+    if data[:len(SAVE_MAGIC)] != SAVE_MAGIC:
+        print(f"{filename} is not a YASC save file.")
+        return None
+    version, = struct.unpack('<H', data[len(SAVE_MAGIC):prefix])
+    if version != SAVE_VERSION:
+        print(f"Unsupported save file version {version}")
+        return None
+
+    # A truncated or damaged file fails in the decompressor or when a block runs past the end of the payload
+    try:
+        payload = zlib.decompress(data[prefix:])
+        (grid_size, num_bots, seed, tick_count, last_entity_id, bot_color_index, letter_index, current_number,
+         game_over, has_input_log, rng_version, rng_gauss) = struct.unpack_from(SAVE_HEADER, payload)
+        offset = struct.calcsize(SAVE_HEADER)
+        arrays = []
+        for dtype in (np.uint32, np.int32, np.int32, np.int32, np.uint32, np.int32, np.int32, np.int32,
+                      ENTITY_RECORD, np.uint8, np.int32, np.int32, np.uint8, np.int64, np.int32, np.uint8):
+            size, = struct.unpack_from('<Q', payload, offset)
+            arrays.append(np.frombuffer(payload, dtype=dtype, count=size // np.dtype(dtype).itemsize,
+                                        offset=offset + 8))
+            offset += 8 + size
+    except (zlib.error, struct.error, ValueError) as error:
+        print(f"{filename} is a corrupt save file ({error}).")
+        return None
+    (rng_internal, chunk_xs, chunk_ys, run_values, run_lengths, trail_xs, trail_ys, trail_ids,
+     table, names, trail_cells, path_cells, score_names, score_values, input_ticks, input_codes) = arrays
+
+    # Simulation() rebuilds the bot color list from the seed, then the generator continues where it was
+    sim = Simulation(grid_size, num_bots, spawn=False, seed=seed)
+    sim.rng.setstate((rng_version, tuple(rng_internal.tolist()), None if rng_gauss != rng_gauss else rng_gauss))
+    sim.tick_count, sim.last_entity_id, sim.bot_color_index, sim.game_over = (tick_count, last_entity_id,
+                                                                              bot_color_index, bool(game_over))
+    sim.score_manager.current_letter_index, sim.score_manager.current_number = letter_index, current_number
+    sim.input_log = list(zip(input_ticks.tolist(), decode_names(input_codes))) if has_input_log else None
+
+    cells = np.repeat(run_values, run_lengths).reshape(-1, CHUNK_SIZE, CHUNK_SIZE)
+    sim.ownership.restore(chunk_xs, chunk_ys, cells)
+    sim.trails.owner.put(trail_xs, trail_ys, trail_ids)
+
+    # Entities are rebuilt field by field, without running the constructors (which would claim
+    # territory, draw colors and consume random numbers)
+    trail_cells, path_cells = trail_cells.reshape(-1, 2).tolist(), path_cells.reshape(-1, 2).tolist()
+    trail_start = path_start = 0
+    for row, name in zip(table.tolist(), decode_names(names)):
+        record = dict(zip(ENTITY_RECORD.names, row))
+        entity = (Bot if record['is_bot'] else Player).blank(sim)
+        entity.id, entity.x, entity.y, entity.name = record['id'], record['x'], record['y'], name
+        entity.color = entity.trail_color = tuple(record['color'].tolist())
+        entity.territory_color = darker_shade(entity.color)
+        entity.moving, entity.change_direction_counter = bool(record['moving']), record['change_direction_counter']
+        entity.direction = tuple(record['direction'].tolist()) if record['has_direction'] else None
+        entity.last_direction = tuple(record['last_direction'].tolist()) if record['has_last_direction'] else None
+        entity.trail = Trail(tuple(cell) for cell in trail_cells[trail_start:trail_start + record['trail_length']])
+        entity.trail_length = record['trail_length']
+        trail_start += record['trail_length']
+        entity._territory = TerritoryView(sim.ownership, entity)
+        if record['is_bot']:
+            for field in BOT_STATE_FIELDS:
+                setattr(entity, field, record[field])
+            entity.rng = random.Random(entity.rng_seed)
+            entity.path_cache = None
+            if record['path_length'] >= 0:
+                path = [tuple(cell) for cell in path_cells[path_start:path_start + record['path_length']]]
+                entity.path_cache = (PATH_GOALS[record['path_goal']], tuple(record['path_target'].tolist()), path)
+                path_start += record['path_length']
+            sim.bots.append(entity)
+        else:
+            sim.player = entity
+        sim.all_entities.append(entity)
+
+    sim.by_id = {entity.id: entity for entity in sim.all_entities}
+    sim.score_manager.restore(sim.all_entities, dict(zip(decode_names(score_names), score_values.tolist())))
 
     print(f"Game loaded from {filename}")
-    return player, bots, score_manager, territories
+    return sim
+
+
+class SpawnIndex:
+    # Room for new entities per SPAWN_BLOCK x SPAWN_BLOCK block. crowding counts the heads in the blocks around
+    # each block that are close enough to come within MIN_SPAWN_DISTANCE of one of its cells, so every cell of a
+    # block with crowding 0 is clear; the ownership and trail grids count their cells per block as they change.
+    # crowding is built from the heads the first time a tick needs it, then kept up to date as entities are removed
+    # and spawned, so each of many respawns in one tick costs a few array operations over the blocks
+    REACH = -(-(MIN_SPAWN_DISTANCE - 1) // SPAWN_BLOCK)  # Blocks from a head's block that it may be too close to
+
+    def __init__(self, world):
+        self.world = world
+        self.blocks = len(world.ownership.owner.block_counts)
+        self.low, self.high = SPAWN_BORDER, world.grid_size - 1 - SPAWN_BORDER
+        self.starts = np.maximum(np.arange(self.blocks) * SPAWN_BLOCK, self.low)
+        self.ends = np.minimum(np.arange(1, self.blocks + 1) * SPAWN_BLOCK - 1, self.high)
+        widths = np.maximum(self.ends - self.starts + 1, 0)
+        self.room = widths[:, None] * widths[None, :]  # Cells of each block inside the spawn range
+        self.crowding = None
+        self.tick = None
+
+    def current(self):
+        # crowding for the heads as they are now, built on the first call of a tick
+        world = self.world
+        if self.tick != world.tick_count:
+            heads = np.zeros((self.blocks, self.blocks), dtype=np.int32)
+            if world.all_entities:
+                xs, ys = world.entity_columns(world.all_entities, 'x', 'y')
+                np.add.at(heads, (xs >> SPAWN_BLOCK_BITS, ys >> SPAWN_BLOCK_BITS), 1)
+            # Box sums over (2 * REACH + 1)^2 blocks from a zero-bordered summed-area table
+            k = 2 * self.REACH + 1
+            table = np.zeros((self.blocks + k,) * 2, dtype=np.int32)
+            table[1:, 1:] = np.pad(heads, self.REACH).cumsum(axis=0).cumsum(axis=1)
+            self.crowding = table[k:, k:] - table[:-k, k:] - table[k:, :-k] + table[:-k, :-k]
+            self.tick = world.tick_count
+        return self.crowding
+
+    def _count(self, entity, change):
+        if self.tick != self.world.tick_count:
+            return  # Rebuilt from scratch on the next spawn anyway
+        bx, by = entity.x >> SPAWN_BLOCK_BITS, entity.y >> SPAWN_BLOCK_BITS
+        reach = self.REACH
+        self.crowding[max(bx - reach, 0):bx + reach + 1, max(by - reach, 0):by + reach + 1] += change
+
+    def add(self, entity):
+        self._count(entity, 1)
+
+    def remove(self, entity):
+        self._count(entity, -1)
+
+    def cells(self, bx, by):
+        # The cells of a block inside the spawn range, with their owner and trail owner ids
+        world = self.world
+        x0, y0, x1, y1 = self.starts[bx], self.starts[by], self.ends[bx] + 1, self.ends[by] + 1
+        owners = world.ownership.owner.region(x0, y0, x1, y1)
+        trails = world.trails.owner.region(x0, y0, x1, y1)
+        return x0, y0, owners, trails
+
+    def pick(self, x0, y0, allowed):
+        lx, ly = divmod(int(np.flatnonzero(allowed)[self.world.rng.randrange(np.count_nonzero(allowed))]),
+                        allowed.shape[1])
+        return x0 + lx, y0 + ly
+
+    def find(self):
+        # A clear cell, preferably one nobody owns, else one in a bot's territory, never the player's and never
+        # on a trail. On a map too crowded for that, the cell farthest from the heads in a few of the least crowded
+        # blocks
+        world = self.world
+        rng = world.rng
+        player_id = world.player.id if world.player else None
+        crowding = self.current()
+        clear = (crowding == 0) & (self.room > 0)
+
+        # The room left over by the owned and trail cells of a block is a lower bound of its unowned
+        # cells without a trail in range, so a block picked by it always has one
+        free = np.where(clear, self.room - world.ownership.owner.block_counts - world.trails.owner.block_counts, 0)
+        cum_free = np.cumsum(np.maximum(free, 0))
+        if cum_free[-1] > 0:
+            bx, by = divmod(int(np.searchsorted(cum_free, rng.randrange(int(cum_free[-1])), side='right')), self.blocks)
+            x0, y0, owners, trails = self.cells(bx, by)
+            return self.pick(x0, y0, (owners == 0) & (trails == 0))
+
+        candidates = np.flatnonzero(clear).tolist()
+        for key in rng.sample(candidates, min(len(candidates), SPAWN_ATTEMPTS)):
+            x0, y0, owners, trails = self.cells(*divmod(key, self.blocks))
+            allowed = (owners != player_id) & (trails == 0)
+            if allowed.any():
+                return self.pick(x0, y0, allowed)
+
+        # Nothing is clear: of the least crowded blocks with room, keep the cell farthest from any head
+        roomy = np.flatnonzero(self.room > 0)
+        levels = crowding.ravel()[roomy]
+        order = []
+        for level in np.unique(levels).tolist():
+            blocks = roomy[levels == level].tolist()
+            order += rng.sample(blocks, min(len(blocks), SPAWN_ATTEMPTS - len(order)))
+            if len(order) == SPAWN_ATTEMPTS:
+                break
+        bxs, bys = np.divmod(np.array(order, dtype=np.intp), self.blocks)
+        offsets = np.arange(SPAWN_BLOCK)
+        xs = np.repeat((bxs * SPAWN_BLOCK)[:, None] + offsets, SPAWN_BLOCK, axis=1)
+        ys = np.tile((bys * SPAWN_BLOCK)[:, None] + offsets, SPAWN_BLOCK)
+        allowed = ((xs >= self.low) & (xs <= self.high) & (ys >= self.low) & (ys <= self.high)
+                   & (world.ownership.owner.take(xs, ys) != player_id) & (world.trails.owner.take(xs, ys) == 0))
+        compared = np.flatnonzero(allowed.any(axis=1))[:SPAWN_CANDIDATES]
+        if len(compared):
+            # Distances from the allowed cells of the compared blocks to the heads close enough to matter
+            around = np.zeros((self.blocks, self.blocks), dtype=bool)
+            reach = self.REACH
+            for bx, by in zip(bxs[compared].tolist(), bys[compared].tolist()):
+                around[max(bx - reach, 0):bx + reach + 1, max(by - reach, 0):by + reach + 1] = True
+            head_xs, head_ys = world.entity_columns(world.all_entities, 'x', 'y')
+            near = around[head_xs >> SPAWN_BLOCK_BITS, head_ys >> SPAWN_BLOCK_BITS]
+            head_xs, head_ys = head_xs[near], head_ys[near]
+            mask = allowed[compared]
+            xs, ys = xs[compared][mask], ys[compared][mask]
+            clearance = np.full(len(xs), MIN_SPAWN_DISTANCE ** 2)  # Squared, and anything clear counts the same
+            if len(head_xs):
+                nearest = ((xs[:, None] - head_xs) ** 2 + (ys[:, None] - head_ys) ** 2).min(axis=1)
+                clearance = np.minimum(clearance, nearest)
+            k = int(np.argmax(clearance))
+            return int(xs[k]), int(ys[k])
+
+        # The player's territory and trails cover the blocks tried; any other cell in range does
+        xs, ys, owners = world.ownership.owner.find()
+        other = (owners != player_id) & (xs >= self.low) & (xs <= self.high) & (ys >= self.low) & (ys <= self.high)
+        if other.any():
+            k = rng.choice(np.flatnonzero(other).tolist())
+            return int(xs[k]), int(ys[k])
+        return rng.randint(self.low, self.high), rng.randint(self.low, self.high)
+
+
+def find_valid_spawn_position(world):
+    # Picked through the world's SpawnIndex, in about constant time however crowded the map is
+    return world.spawn_index.find()
+
+
+def darker_shade(color, factor=0.5):
+    return tuple(int(c * factor) for c in color)
+
+
+def enclosed_cells(wall):
+    # Mask of the free cells of a bitmap that can't reach its edge without crossing a wall cell.
+    # The free cells of each column are split into runs (vectorized), then the runs are labelled by
+    # walking from the runs on the edge to overlapping runs in the neighbouring columns; whatever
+    # isn't reached is enclosed. Cost is O(area) for the runs plus O(number of runs) for the walk.
+    width, height = wall.shape
+    free = np.zeros((width, height + 2), dtype=np.int8)
+    free[:, 1:-1] = ~wall
+    edges = np.diff(free, axis=1)
+    run_x, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1]  # exclusive
+    if not len(run_x):
+        return np.zeros_like(wall)
+
+    first_run = np.searchsorted(run_x, np.arange(width + 1)).tolist()
+    run_x, run_start, run_end = run_x.tolist(), run_start.tolist(), run_end.tolist()
+
+    outside = [False] * len(run_x)
+    stack = [r for r in range(len(run_x))
+             if run_x[r] == 0 or run_x[r] == width - 1 or run_start[r] == 0 or run_end[r] == height]
+    for r in stack:
+        outside[r] = True
+    while stack:
+        r = stack.pop()
+        x, start, end = run_x[r], run_start[r], run_end[r]
+        for nx in (x - 1, x + 1):
+            if 0 <= nx < width:
+                for n in range(first_run[nx], first_run[nx + 1]):
+                    if run_start[n] >= end:
+                        break
+                    if run_end[n] > start and not outside[n]:
+                        outside[n] = True
+                        stack.append(n)
+
+    # Paint the runs nobody reached back into a mask
+    inside = [r for r in range(len(run_x)) if not outside[r]]
+    marks = np.zeros((width, height + 1), dtype=np.int32)
+    if inside:
+        np.add.at(marks, ([run_x[r] for r in inside], [run_start[r] for r in inside]), 1)
+        np.add.at(marks, ([run_x[r] for r in inside], [run_end[r] for r in inside]), -1)
+    return np.cumsum(marks, axis=1)[:, :height] > 0
+
+
+def l1_distance_transform(mask):
+    # Steps (4-neighbour moves, ignoring obstacles) from every cell to the nearest True cell of mask, or the sum of
+    # the sides where mask is empty. The L1 distance is separable: one forward and one backward running minimum
+    # along each axis
+    unreachable = sum(mask.shape)
+    dtype = np.int16 if 2 * unreachable < np.iinfo(np.int16).max else np.int32
+    distance = np.where(mask, 0, unreachable).astype(dtype)
+    for axis in (0, 1):
+        distance = np.moveaxis(distance, axis, 0)
+        steps = np.arange(distance.shape[0], dtype=dtype).reshape(-1, 1)
+        forward = np.minimum.accumulate(distance - steps, axis=0) + steps
+        backward = np.minimum.accumulate((distance + steps)[::-1], axis=0)[::-1] - steps
+        distance = np.moveaxis(np.minimum(forward, backward), 0, axis)
+    return distance
+
+
+class TerritoryDelta:
+    # Cells that changed hands in one capture, together with their previous owners (0 = unowned)
+    def __init__(self, owner_id, xs, ys, previous):
+        self.owner_id = owner_id
+        self.xs = xs
+        self.ys = ys
+        self.previous = previous
+
+    def __len__(self):
+        return len(self.xs)
+
+    def previous_owners(self):
+        owners, counts = np.unique(self.previous, return_counts=True)
+        return {int(o): int(n) for o, n in zip(owners, counts) if o}
+
+
+class ChunkedArray:
+    # A size x size int32 array stored in CHUNK_SIZE x CHUNK_SIZE chunks that are only allocated when first
+    # written. slots[cx, cy] is a chunk's index into the arena (-1 = never written, reads as 0) and
+    # counts[cx, cy] its number of non-zero cells, so whole empty areas can be skipped; block_counts holds the
+    # same per SPAWN_BLOCK x SPAWN_BLOCK block, for spawn placement. dirty flags the arena slots written
+    # since the last take_dirty(), for a copy that is kept in sync chunk by chunk
+    def __init__(self, size):
+        self.size = size
+        self.chunks = -(-size // CHUNK_SIZE)
+        self.slots = np.full((self.chunks, self.chunks), -1, dtype=np.int32)
+        self.counts = np.zeros((self.chunks, self.chunks), dtype=np.int32)
+        self.block_counts = np.zeros((self.chunks << CHUNK_BITS >> SPAWN_BLOCK_BITS,) * 2, dtype=np.int32)
+        self.arena = np.zeros((0, CHUNK_SIZE, CHUNK_SIZE), dtype=np.int32)
+        self.dirty = np.zeros(0, dtype=bool)
+        self.used = 0
+
+    def clear(self):
+        self.slots.fill(-1)
+        self.counts.fill(0)
+        self.block_counts.fill(0)
+        self.used = 0
+
+    def _allocate(self, cxs, cys):
+        # Give the chunks (cxs[i], cys[i]) a zeroed slot each; the arena grows by doubling
+        n = len(cxs)
+        if self.used + n > len(self.arena):
+            grown = np.zeros((max(2 * len(self.arena), self.used + n, 4), CHUNK_SIZE, CHUNK_SIZE), dtype=np.int32)
+            grown[:self.used] = self.arena[:self.used]
+            self.arena = grown
+            self.dirty = np.concatenate((self.dirty, np.zeros(len(grown) - len(self.dirty), dtype=bool)))
+        self.arena[self.used:self.used + n] = 0
+        self.dirty[self.used:self.used + n] = True
+        self.slots[cxs, cys] = np.arange(self.used, self.used + n)
+        self.used += n
+
+    def get(self, x, y):
+        slot = self.slots[x >> CHUNK_BITS, y >> CHUNK_BITS]
+        if slot < 0:
+            return 0
+        return int(self.arena[slot, x & CHUNK_MASK, y & CHUNK_MASK])
+
+    def set(self, x, y, value):
+        cx, cy = x >> CHUNK_BITS, y >> CHUNK_BITS
+        if self.slots[cx, cy] < 0:
+            if not value:
+                return
+            self._allocate([cx], [cy])
+        cell = (self.slots[cx, cy], x & CHUNK_MASK, y & CHUNK_MASK)
+        change = int(value != 0) - int(self.arena[cell] != 0)
+        self.counts[cx, cy] += change
+        self.block_counts[x >> SPAWN_BLOCK_BITS, y >> SPAWN_BLOCK_BITS] += change
+        self.arena[cell] = value
+        self.dirty[cell[0]] = True
+
+    def take(self, xs, ys):
+        # Values at the cells (xs[i], ys[i])
+        if not self.used:
+            return np.zeros(np.broadcast(xs, ys).shape, dtype=np.int32)
+        slots = self.slots[xs >> CHUNK_BITS, ys >> CHUNK_BITS]
+        values = self.arena[np.maximum(slots, 0), xs & CHUNK_MASK, ys & CHUNK_MASK]
+        values[slots < 0] = 0
+        return values
+
+    def put(self, xs, ys, values):
+        # Write values (an array or one value) into the cells (xs[i], ys[i]); the cells must be distinct
+        if not len(xs):
+            return
+        cxs, cys = xs >> CHUNK_BITS, ys >> CHUNK_BITS
+        missing = self.slots[cxs, cys] < 0
+        if missing.any():
+            keys = np.unique(cxs[missing] * self.chunks + cys[missing])
+            self._allocate(*np.divmod(keys, self.chunks))
+        cell = (self.slots[cxs, cys], xs & CHUNK_MASK, ys & CHUNK_MASK)
+        values = np.broadcast_to(np.asarray(values, dtype=np.int32), np.shape(xs))
+        changes = (values != 0).astype(np.int32) - (self.arena[cell] != 0)
+        np.add.at(self.counts, (cxs, cys), changes)
+        np.add.at(self.block_counts, (xs >> SPAWN_BLOCK_BITS, ys >> SPAWN_BLOCK_BITS), changes)
+        self.arena[cell] = values
+        self.dirty[cell[0]] = True
+
+    def region(self, x0, y0, x1, y1):
+        # Dense copy of [x0:x1, y0:y1], assembled from the chunks it overlaps
+        out = np.zeros((x1 - x0, y1 - y0), dtype=np.int32)
+        for cx in range(x0 >> CHUNK_BITS, ((x1 - 1) >> CHUNK_BITS) + 1):
+            for cy in range(y0 >> CHUNK_BITS, ((y1 - 1) >> CHUNK_BITS) + 1):
+                slot = self.slots[cx, cy]
+                if slot < 0 or not self.counts[cx, cy]:
+                    continue
+                bx0, by0 = max(x0, cx * CHUNK_SIZE), max(y0, cy * CHUNK_SIZE)
+                bx1, by1 = min(x1, (cx + 1) * CHUNK_SIZE), min(y1, (cy + 1) * CHUNK_SIZE)
+                out[bx0 - x0:bx1 - x0, by0 - y0:by1 - y0] = \
+                    self.arena[slot, bx0 - cx * CHUNK_SIZE:bx1 - cx * CHUNK_SIZE, by0 - cy * CHUNK_SIZE:by1 - cy * CHUNK_SIZE]
+        return out
+
+    def copy_chunks(self):
+        # Copy of the non-empty chunks as (cxs, cys, blocks)
+        cxs, cys = np.nonzero(self.counts)
+        return cxs, cys, self.arena[self.slots[cxs, cys]]
+
+    def find(self, value=None, chunks=None):
+        # Cells equal to value (any non-zero value if None), looking only at the given (cx, cy) chunks
+        # or else at all non-empty ones. Returns (xs, ys, values)
+        if chunks is None:
+            cxs, cys = np.nonzero(self.counts)
+        else:
+            keys = np.array(sorted(chunks), dtype=np.intp).reshape(-1, 2)
+            cxs, cys = keys[:, 0], keys[:, 1]
+        slots = self.slots[cxs, cys]
+        present = slots >= 0
+        blocks = self.arena[slots[present]]
+        cxs, cys = cxs[present], cys[present]
+        k, lx, ly = np.nonzero(blocks != 0 if value is None else blocks == value)
+        return cxs[k] * CHUNK_SIZE + lx, cys[k] * CHUNK_SIZE + ly, blocks[k, lx, ly]
+
+    def load_chunks(self, cxs, cys, blocks):
+        # Write whole chunks at once; the chunks must not have been allocated yet
+        self._allocate(cxs, cys)
+        self.arena[self.slots[cxs, cys]] = blocks
+        self.counts[cxs, cys] = np.count_nonzero(blocks, axis=(1, 2))
+        per_chunk = CHUNK_SIZE >> SPAWN_BLOCK_BITS
+        bxs = (np.asarray(cxs) * per_chunk)[:, None, None] + np.arange(per_chunk)[None, :, None]
+        bys = (np.asarray(cys) * per_chunk)[:, None, None] + np.arange(per_chunk)[None, None, :]
+        self.block_counts[bxs, bys] = np.count_nonzero(
+            blocks.reshape(-1, per_chunk, SPAWN_BLOCK, per_chunk, SPAWN_BLOCK), axis=(2, 4))
+
+    def take_dirty(self):
+        # Arena slots written since the last call
+        slots = np.flatnonzero(self.dirty[:self.used])
+        self.dirty[:] = False
+        return slots
+
+    def max(self):
+        return int(self.arena[:self.used].max()) if self.used else 0
+
+    def to_dense(self):
+        return self.region(0, 0, self.size, self.size)
+
+
+class ChangeLog:
+    # Cells changed since the last take(), for the renderer. Past `limit` cells it stops collecting and
+    # take() returns None, meaning "assume everything changed", so it stays small when nobody reads it
+    def __init__(self, limit=CHANGE_LOG_LIMIT):
+        self.limit = limit
+        self.parts = []
+        self.count = 0
+        self.overflow = True  # Nothing has been drawn yet
+
+    def record(self, xs, ys):
+        if self.overflow:
+            return
+        self.count += len(xs)
+        if self.count > self.limit:
+            self.overflow = True
+            self.parts = []
+        else:
+            self.parts.append((np.asarray(xs), np.asarray(ys)))
 
+    def mark_all(self):
+        self.overflow = True
+        self.parts = []
 
-def is_on_border(x, y):
-    return x < 0 or x >= GRID_SIZE or y < 0 or y >= GRID_SIZE
+    def take(self):
+        if self.overflow:
+            changes = None
+        elif self.parts:
+            changes = (np.concatenate([xs for xs, _ in self.parts]), np.concatenate([ys for _, ys in self.parts]))
+        else:
+            changes = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self.parts = []
+        self.count = 0
+        self.overflow = False
+        return changes
+
+
+class OwnershipGrid:
+    # One owner id per cell (0 = unowned); the per-entity territories are views onto this grid.
+    # owner_chunks remembers which chunks an owner has claimed cells in, so releasing or listing one
+    # territory only scans those chunks (it may name chunks the owner has since lost, never too few)
+    def __init__(self, size):
+        self.size = size
+        self.owner = ChunkedArray(size)
+        self.area_by_owner = {}
+        self.owner_chunks = {}
+        self.changes = ChangeLog()
+        self.changed_owners = set()  # Owners whose area changed, until the scores pick them up
+        self.versions = {}  # Per owner, bumped whenever its cells change, for caches of per-territory data
+
+    def bump(self, owner_ids):
+        for owner_id in owner_ids:
+            self.versions[owner_id] = self.versions.get(owner_id, 0) + 1
+
+    def clear(self):
+        self.owner.clear()
+        self.changed_owners.update(self.area_by_owner)
+        self.bump(self.area_by_owner)
+        self.area_by_owner.clear()
+        self.owner_chunks.clear()
+        self.changes.mark_all()
+
+    def owner_at(self, x, y):
+        if 0 <= x < self.size and 0 <= y < self.size:
+            return self.owner.get(x, y)
+        return 0
+
+    def restore(self, chunk_xs, chunk_ys, blocks):
+        # Replace the whole grid with the given chunks of cells and rebuild the areas and owner_chunks from them
+        self.clear()
+        self.owner.load_chunks(chunk_xs, chunk_ys, blocks)
+        chunk, _, _ = np.nonzero(blocks)
+        owners = blocks[blocks != 0].astype(np.int64)
+        ids, areas = np.unique(owners, return_counts=True)
+        self.area_by_owner.update(zip(ids.tolist(), areas.tolist()))
+        self.changed_owners.update(self.area_by_owner)
+        self.bump(self.area_by_owner)
+        keys = np.unique(owners * len(blocks) + chunk)
+        for owner_id, k in zip(*np.divmod(keys, len(blocks))):
+            self.owner_chunks.setdefault(int(owner_id), set()).add((int(chunk_xs[k]), int(chunk_ys[k])))
+
+    def claim(self, positions, owner_id):
+        # Write owner_id into the given cells and return only what actually changed,
+        # so the bookkeeping touches the previous owners of those cells and nobody else
+        if not isinstance(positions, np.ndarray):
+            positions = list(positions)
+        cells = np.array(positions, dtype=np.intp).reshape(-1, 2)
+        inside = (cells >= 0).all(axis=1) & (cells < self.size).all(axis=1)
+        flat = np.unique(cells[inside, 0] * self.size + cells[inside, 1])
+        xs, ys = np.divmod(flat, self.size)
+        previous = self.owner.take(xs, ys)
+        changed = previous != owner_id
+        delta = TerritoryDelta(owner_id, xs[changed], ys[changed], previous[changed])
+        self.owner.put(delta.xs, delta.ys, owner_id)
+        if len(delta):
+            chunks = np.unique((delta.xs >> CHUNK_BITS) * self.owner.chunks + (delta.ys >> CHUNK_BITS))
+            self.owner_chunks.setdefault(owner_id, set()).update(divmod(int(key), self.owner.chunks) for key in chunks)
+        self.changes.record(delta.xs, delta.ys)
+        self._account(delta)
+        return delta
+
+    def release(self, owner_id):
+        xs, ys, _ = self.owner.find(owner_id, self.owner_chunks.pop(owner_id, ()))
+        delta = TerritoryDelta(0, xs, ys, np.full(len(xs), owner_id, dtype=np.int32))
+        self.owner.put(xs, ys, 0)
+        self.changes.record(xs, ys)
+        self._account(delta)
+        self.versions.pop(owner_id, None)  # Ids aren't reused
+        return delta
+
+    def _account(self, delta):
+        if delta.owner_id and len(delta):
+            self.area_by_owner[delta.owner_id] = self.area_by_owner.get(delta.owner_id, 0) + len(delta)
+            self.changed_owners.add(delta.owner_id)
+            self.bump((delta.owner_id,))
+        for previous_id, lost in delta.previous_owners().items():
+            self.changed_owners.add(previous_id)
+            self.bump((previous_id,))
+            remaining = self.area_by_owner.get(previous_id, 0) - lost
+            if remaining > 0:
+                self.area_by_owner[previous_id] = remaining
+            else:
+                self.area_by_owner.pop(previous_id, None)
+
+    def assign(self, owner_id, positions):
+        self.release(owner_id)
+        return self.claim(positions, owner_id)
+
+    def area(self, owner_id):
+        return self.area_by_owner.get(owner_id, 0)
+
+    def cells(self, owner_id):
+        xs, ys, _ = self.owner.find(owner_id, self.owner_chunks.get(owner_id, ()))
+        return zip(xs.tolist(), ys.tolist())
+
+
+class TrailGrid:
+    # Owner id of the trail on each cell (0 = no trail). A step's new trail cells are only marked after
+    # that step's collision check, so the check sees every trail as it was before the entities moved
+    def __init__(self, size):
+        self.size = size
+        self.owner = ChunkedArray(size)
+        self.changes = ChangeLog()
+
+    def clear(self):
+        self.owner.clear()
+        self.changes.mark_all()
+
+    def owner_at(self, x, y):
+        if 0 <= x < self.size and 0 <= y < self.size:
+            return self.owner.get(x, y)
+        return 0
+
+    def mark(self, x, y, owner_id):
+        self.owner.set(x, y, owner_id)
+        self.changes.record((x,), (y,))
+
+    def erase(self, cells, owner_id):
+        # Only erase cells that still carry this owner's id
+        cells = np.unique(np.array(list(cells), dtype=np.intp).reshape(-1, 2), axis=0)
+        xs, ys = cells[:, 0], cells[:, 1]
+        mine = self.owner.take(xs, ys) == owner_id
+        self.owner.put(xs[mine], ys[mine], 0)
+        self.changes.record(xs[mine], ys[mine])
+
+
+class SpatialHash:
+    # Uniform grid of entity heads for radius and k-nearest queries. It is rebuilt once per step, so
+    # entities that already moved in the current step may be off by one tile
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.buckets = {}
+        self.keys = {}
+        self.bounds = None  # (min bucket x, min bucket y, max bucket x, max bucket y)
+
+    def rebuild(self, entities):
+        self.buckets = {}
+        self.keys = {}
+        self.bounds = None
+        for entity in entities:
+            self.insert(entity)
+
+    def insert(self, entity):
+        key = (entity.x // self.cell_size, entity.y // self.cell_size)
+        self.buckets.setdefault(key, []).append(entity)
+        self.keys[entity] = key
+        if self.bounds is None:
+            self.bounds = key + key
+        else:
+            min_x, min_y, max_x, max_y = self.bounds
+            self.bounds = (min(min_x, key[0]), min(min_y, key[1]), max(max_x, key[0]), max(max_y, key[1]))
+
+    def remove(self, entity):
+        key = self.keys.pop(entity, None)
+        if key is not None:
+            bucket = self.buckets[key]
+            bucket.remove(entity)
+            if not bucket:
+                del self.buckets[key]
+
+    def within(self, x, y, radius, exclude=None):
+        cs = self.cell_size
+        found = []
+        for cx in range(int(x - radius) // cs, int(x + radius) // cs + 1):
+            for cy in range(int(y - radius) // cs, int(y + radius) // cs + 1):
+                for entity in self.buckets.get((cx, cy), ()):
+                    if entity is not exclude and (entity.x - x) ** 2 + (entity.y - y) ** 2 <= radius * radius:
+                        found.append(entity)
+        return found
+
+    def nearest(self, x, y, k=1, exclude=None):
+        # Search rings of buckets outwards; once the k-th best distance is no more than the distance to
+        # the next ring, nothing further out can beat it. Returns up to k (distance, entity) pairs.
+        cs = self.cell_size
+        cx, cy = x // cs, y // cs
+        if self.bounds:
+            min_x, min_y, max_x, max_y = self.bounds
+            max_ring = max(cx - min_x, max_x - cx, cy - min_y, max_y - cy)
+        else:
+            max_ring = -1
+        best = []
+        ring = 0
+        while ring <= max_ring:
+            for bx in range(cx - ring, cx + ring + 1):
+                for by in range(cy - ring, cy + ring + 1):
+                    if max(abs(bx - cx), abs(by - cy)) != ring:
+                        continue
+                    for entity in self.buckets.get((bx, by), ()):
+                        if entity is not exclude:
+                            best.append((((entity.x - x) ** 2 + (entity.y - y) ** 2) ** 0.5, entity))
+            if len(best) >= k:
+                best.sort(key=lambda pair: pair[0])
+                del best[k:]
+                if best[-1][0] <= ring * cs:
+                    break
+            ring += 1
+        best.sort(key=lambda pair: pair[0])
+        return best[:k]
+
+
+class TacticalField:
+    # Per-step distance field shared by all bots: for every cell, the distance (in king moves) to the
+    # nearest trail cell, up to a fixed radius. Each cell keeps the two nearest *different* owners,
+    # so "nearest enemy" is a lookup for every bot, even when the nearest trail is the bot's own.
+    # It is only exact where bots look this step: the chunks their trail windows (TRAIL_FIELD_RADIUS around
+    # their heads) touch. Those cells only depend on trail cells and cells in the same or a neighbouring chunk
+    # (the radius is below CHUNK_SIZE), so the field covers that ring, minus chunks no trail can reach;
+    # slots[cx, cy] is a covered chunk's index into the field arrays, -1 for the rest. The arrays are
+    # reused from step to step and only grow.
+    # Enemy heads are looked up in the world's spatial hash instead, which holds the same tick-start
+    # positions and only needs the buckets around the query
+    NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+    def __init__(self, size):
+        self.size = size
+        self.chunks = -(-size // CHUNK_SIZE)
+        self.slots = np.full((self.chunks, self.chunks), -1, dtype=np.int32)
+        self.covered = 0
+        self.buffers = None  # (dist, owner, source), each of shape (2, capacity in cells)
+        self.trail_field = None
+        self.spatial = None
+
+    def update(self, world, xs, ys):
+        # xs, ys: heads of the bots that will query the field this step
+        reach = self.cover(world.trails.owner, xs, ys)
+        trail_xs, trail_ys, owners = world.trails.owner.find(chunks=zip(*np.nonzero(reach)))
+        self.trail_field = self.multi_source_bfs(trail_xs, trail_ys, owners, TRAIL_FIELD_RADIUS)
+        self.spatial = world.spatial
+
+    def dilate(self, chunks):
+        # The chunks and their neighbours
+        padded = np.zeros((self.chunks + 2, self.chunks + 2), dtype=bool)
+        padded[1:-1, 1:-1] = chunks
+        grown = np.zeros((self.chunks, self.chunks), dtype=bool)
+        for dx in range(3):
+            for dy in range(3):
+                grown |= padded[dx:dx + self.chunks, dy:dy + self.chunks]
+        return grown
+
+    def cover(self, trails, xs, ys):
+        # Give a slot to the chunks the queries around the heads (xs, ys) depend on that a trail can reach;
+        # returns the chunks whose trail cells are the sources
+        queried = np.zeros((self.chunks, self.chunks), dtype=bool)
+        radius = TRAIL_FIELD_RADIUS
+        for dx in (-radius, radius):
+            for dy in (-radius, radius):  # A window is smaller than a chunk, its corners touch every chunk it does
+                queried[np.clip((xs + dx) >> CHUNK_BITS, 0, self.chunks - 1),
+                        np.clip((ys + dy) >> CHUNK_BITS, 0, self.chunks - 1)] = True
+        reach = self.dilate(queried) & (trails.counts > 0)
+        covered = self.dilate(queried) & self.dilate(reach)
+        self.slots.fill(-1)
+        self.slots[covered] = np.arange(int(covered.sum()))
+        self.covered = int(covered.sum())
+        return reach
+
+    def index(self, x, y):
+        # Position of the cells (x, y) in the field arrays; the cells must be in covered chunks
+        slot = self.slots.ravel()[(x >> CHUNK_BITS) * self.chunks + (y >> CHUNK_BITS)]
+        return (slot << (2 * CHUNK_BITS)) + ((x & CHUNK_MASK) << CHUNK_BITS) + (y & CHUNK_MASK)
+
+    def new_field(self, radius):
+        n = self.covered << (2 * CHUNK_BITS)
+        if self.buffers is None or self.buffers[0].shape[1] < n:
+            capacity = max(n, 2 * self.buffers[0].shape[1] if self.buffers else 0)
+            self.buffers = tuple(np.empty((2, capacity), dtype=np.int32) for _ in range(3))
+        dist, owner, source = (buffer[:, :n] for buffer in self.buffers)
+        dist.fill(radius + 1)
+        owner.fill(0)
+        source.fill(-1)
+        return dist, owner, source
+
+    def multi_source_bfs(self, xs, ys, owners, radius):
+        # Level-synchronous BFS, one numpy pass per distance level. Returns (dist, owner, source) arrays
+        # of shape (2, covered cells) for the two nearest owners; sources are flat cells (x * size + y).
+        # Cells outside the covered chunks are dropped from the frontier
+        field = self.new_field(radius)
+
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        frontier = self._accept(field, xs, ys, self.index(xs, ys), np.asarray(owners, dtype=np.int64),
+                                xs * self.size + ys, 0)
+        offsets = np.array(self.NEIGHBOURS, dtype=np.int64)
+        slots = np.full((self.chunks + 2, self.chunks + 2), -1, dtype=np.int64)  # Padded, so x or y = -1 reads -1
+        slots[1:-1, 1:-1] = self.slots
+        for level in range(1, radius + 1):
+            xs, ys, owners, sources = frontier
+            if not len(xs):
+                break
+            nx = (xs[:, None] + offsets[:, 0]).ravel()
+            ny = (ys[:, None] + offsets[:, 1]).ravel()
+            slot = slots[(nx >> CHUNK_BITS) + 1, (ny >> CHUNK_BITS) + 1]
+            inside = (slot >= 0) & (nx < self.size) & (ny < self.size)
+            nx, ny = nx[inside], ny[inside]
+            at = (slot[inside] << (2 * CHUNK_BITS)) + ((nx & CHUNK_MASK) << CHUNK_BITS) + (ny & CHUNK_MASK)
+            frontier = self._accept(field, nx, ny, at, np.repeat(owners, len(offsets))[inside],
+                                    np.repeat(sources, len(offsets))[inside], level)
+        return field
+
+    def _accept(self, field, xs, ys, at, owners, sources, level):
+        # at: the cells' positions in the field arrays
+        dist, owner, source = field
+        # Drop candidates for owners a cell already has and for cells that already have two owners
+        keep = (owner[0, at] != owners) & (owner[1, at] == 0)
+        xs, ys, at, owners, sources = xs[keep], ys[keep], at[keep], owners[keep], sources[keep]
+        if not len(xs):
+            return xs, ys, owners, sources
+
+        # One candidate per (cell, owner), lowest owner id first within a cell so ties are deterministic
+        cells = xs * self.size + ys
+        key = cells * (int(owners.max()) + 1) + owners
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        order = order[first]
+        xs, ys, cells, at, owners, sources = xs[order], ys[order], cells[order], at[order], owners[order], sources[order]
+
+        index = np.arange(len(cells))
+        group_start = np.ones(len(cells), dtype=bool)
+        group_start[1:] = cells[1:] != cells[:-1]
+        rank = index - np.maximum.accumulate(np.where(group_start, index, 0))
+
+        empty = owner[0, at] == 0
+        to_first = empty & (rank == 0)
+        to_second = (empty & (rank == 1)) | (~empty & (rank == 0))
+        for slot, chosen in ((0, to_first), (1, to_second)):
+            dist[slot, at[chosen]] = level
+            owner[slot, at[chosen]] = owners[chosen]
+            source[slot, at[chosen]] = sources[chosen]
+
+        accepted = to_first | to_second
+        return xs[accepted], ys[accepted], owners[accepted], sources[accepted]
+
+    def _nearest_enemies(self, field, x, y, owner_id):
+        # Up to two (distance, owner id, source cell) entries for owners other than owner_id
+        if self.slots[x >> CHUNK_BITS, y >> CHUNK_BITS] < 0:
+            return []
+        dist, owner, source = field
+        i = self.index(x, y)
+        found = []
+        for slot in (0, 1):
+            other = int(owner[slot, i])
+            if other and other != owner_id:
+                found.append((int(dist[slot, i]), other, divmod(int(source[slot, i]), self.size)))
+        return found
+
+    def enemy_trails(self, x, y, owner_id, max_distance=TRAIL_FIELD_RADIUS):
+        return [hit for hit in self._nearest_enemies(self.trail_field, x, y, owner_id) if hit[0] <= max_distance]
+
+    def enemy_trail_owners(self, x, y, owner_id, radius=TRAIL_FIELD_RADIUS):
+        # Each enemy with trail in the (2 * radius + 1)^2 window around (x, y), as (its trail cell nearest to
+        # (x, y), owner id), nearest first. Trail cells are the field's distance 0 cells, whose first owner
+        # is the trail's
+        cells = np.arange(-radius, radius + 1)
+        xs = np.repeat(cells + x, len(cells))
+        ys = np.tile(cells + y, len(cells))
+        on_map = (xs >= 0) & (xs < self.size) & (ys >= 0) & (ys < self.size)
+        xs, ys = xs[on_map], ys[on_map]
+        covered = self.slots[xs >> CHUNK_BITS, ys >> CHUNK_BITS] >= 0
+        xs, ys = xs[covered], ys[covered]
+        dist, owner, _ = self.trail_field
+        at = self.index(xs, ys)
+        owners = owner[0, at]
+        hit = (dist[0, at] == 0) & (owners != 0) & (owners != owner_id)
+        xs, ys, owners = xs[hit], ys[hit], owners[hit]
+        order = np.argsort((xs - x) ** 2 + (ys - y) ** 2, kind='stable')
+        _, first = np.unique(owners[order], return_index=True)
+        nearest = order[np.sort(first)]
+        return list(zip(zip(xs[nearest].tolist(), ys[nearest].tolist()), owners[nearest].tolist()))
+
+    def nearest_enemy_head_distance(self, x, y, owner_id):
+        # Euclidean distance to the nearest enemy head, or inf when no head is within HEAD_FIELD_RADIUS
+        # along both axes
+        cs = self.spatial.cell_size
+        radius = HEAD_FIELD_RADIUS
+        best = float('inf')
+        for cx in range((x - radius) // cs, (x + radius) // cs + 1):
+            for cy in range((y - radius) // cs, (y + radius) // cs + 1):
+                for entity in self.spatial.buckets.get((cx, cy), ()):
+                    if entity.id != owner_id and max(abs(entity.x - x), abs(entity.y - y)) <= radius:
+                        best = min(best, ((entity.x - x) ** 2 + (entity.y - y) ** 2) ** 0.5)
+        return best
+
+
+class TerritoryView(Set):
+    # Set-like view of one entity's cells in the ownership grid
+    def __init__(self, grid, entity):
+        self.grid = grid
+        self.entity = entity
 
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+    def __contains__(self, pos):
+        x, y = pos
+        size = self.grid.size
+        return 0 <= x < size and 0 <= y < size and self.grid.owner.get(x, y) == self.entity.id
+
+    def __iter__(self):
+        return self.grid.cells(self.entity.id)
+
+    def __len__(self):
+        return self.grid.area(self.entity.id)
+
+    def update(self, positions):
+        return self.grid.claim(positions, self.entity.id)
+
+    def add(self, pos):
+        return self.grid.claim((pos,), self.entity.id)
+
+
+class HomeField:
+    # For one territory around one position: the steps (ignoring obstacles) from each cell to the nearest cell of
+    # the territory, and inside it the steps to the nearest cell outside, which is 1 on the territory's boundary.
+    # The window is the HOME_FIELD_BLOCK aligned block the position is in plus one block on every side, so the
+    # field is a function of the territory and that block only (the same in every process), and exact for the
+    # whole block up to HOME_FIELD_BLOCK steps. Bots keep theirs until their territory's version or their block changes
+    def __init__(self, ownership, owner_id, x, y):
+        self.key = self.key_for(ownership, owner_id, x, y)
+        _, bx, by = self.key
+        self.x0, self.y0 = max(0, (bx - 1) * HOME_FIELD_BLOCK), max(0, (by - 1) * HOME_FIELD_BLOCK)
+        x1 = min(ownership.size, (bx + 2) * HOME_FIELD_BLOCK)
+        y1 = min(ownership.size, (by + 2) * HOME_FIELD_BLOCK)
+        inside = ownership.owner.region(self.x0, self.y0, x1, y1) == owner_id
+        self.unreachable = sum(inside.shape)
+        self.distance = l1_distance_transform(inside)
+        self.depth = l1_distance_transform(~inside)
 
-def distance(pos1, pos2):
-    return ((pos1[0] - pos2[0]) ** 2 + (pos1[1] - pos2[1]) ** 2) ** 0.5
+    @staticmethod
+    def key_for(ownership, owner_id, x, y):
+        return ownership.versions.get(owner_id, 0), x // HOME_FIELD_BLOCK, y // HOME_FIELD_BLOCK
+
+    def value(self, field, x, y):
+        # The field at (x, y), None outside the window
+        i, j = x - self.x0, y - self.y0
+        if 0 <= i < field.shape[0] and 0 <= j < field.shape[1]:
+            return int(field[i, j])
+        return None
 
+    def descend(self, field, x, y, goal, is_passable):
+        # Walks downhill from (x, y) over passable cells until the field is goal. Returns the path, starting at
+        # (x, y), or None when (x, y) is outside the window, nothing is reachable or every way down is blocked
+        distance = self.value(field, x, y)
+        if distance is None or distance >= self.unreachable:
+            return None
+        path = [(x, y)]
+        while distance > goal:
+            for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+                if self.value(field, x + dx, y + dy) == distance - 1 and is_passable(x + dx, y + dy):
+                    break
+            else:
+                return None
+            x, y, distance = x + dx, y + dy, distance - 1
+            path.append((x, y))
+        return path
+
+    def path_home(self, x, y, is_passable):
+        return self.descend(self.distance, x, y, 0, is_passable)
+
+    def path_to_boundary(self, x, y, is_passable):
+        return self.descend(self.depth, x, y, 1, is_passable)
+
+
+# Pathfinding -----------------------------------------------------------------------------------------------------------------------------------------------------
+def astar_path(start, target, is_passable, node_budget=PATH_NODE_BUDGET):
+    # A* over the 4-neighbourhood with the Manhattan distance as heuristic. Stops as soon as the target
+    # is expanded; if the node budget runs out first, returns the path to the expanded cell closest to
+    # the target instead. Returns None only if the target is unreachable within the budget's reach.
+    def heuristic(cell):
+        return abs(cell[0] - target[0]) + abs(cell[1] - target[1])
+
+    parent = {start: None}
+    cost = {start: 0}
+    open_heap = [(heuristic(start), heuristic(start), start)]
+    closest = start
+    expanded = 0
+
+    while open_heap:
+        f, h, cell = heapq.heappop(open_heap)
+        if cell == target:
+            closest = cell
+            break
+        g = cost[cell]
+        if g + h != f:
+            continue  # Stale heap entry, the cell was reached more cheaply later
+        expanded += 1
+        if h < heuristic(closest):
+            closest = cell
+        if expanded > node_budget:
+            break
+        x, y = cell
+        for neighbour in ((x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)):
+            if neighbour not in cost or g + 1 < cost[neighbour]:
+                if is_passable(*neighbour):
+                    cost[neighbour] = g + 1
+                    parent[neighbour] = cell
+                    nh = heuristic(neighbour)
+                    heapq.heappush(open_heap, (g + 1 + nh, nh, neighbour))
+    else:
+        return None  # Open set exhausted without reaching the target
+
+    path = []
+    cell = closest
+    while cell is not None:
+        path.append(cell)
+        cell = parent[cell]
+    return path[::-1]
+
+
+# Entities --------------------------------------------------------------------------------------------------------------------------------------------------------
+DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0), None)  # Direction codes in the entity store; -1 picks None
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS[:-1])}
+DIRECTION_CODES[None] = -1
+
+
+class EntityStore:
+    # The per-entity state of Player / Bot as typed columns (array.array, one element per slot); the entity
+    # objects are handles holding a slot. Single elements read back as plain Python numbers, and column()
+    # gives a zero-copy numpy view of a whole column for population-wide work. Growing replaces the columns
+    # instead of resizing them, so views taken earlier stay valid (they just don't see the new slots)
+    COLUMNS = {
+        'id': 'i', 'is_bot': 'b', 'x': 'i', 'y': 'i', 'direction': 'b', 'last_direction': 'b', 'moving': 'b',
+        'change_direction_counter': 'i', 'trail_length': 'i',
+        # Bot personality and decision counters
+        'change_direction_threshold': 'i', 'trail_check_counter': 'i', 'trail_check_threshold': 'i',
+        'trail_check_distance': 'i', 'max_trail_length': 'i', 'aggression': 'd', 'base_aggression': 'd',
+    }
 
-def find_valid_spawn_position(existing_entities):
-    border_distance = 3
-    attempts = 0
-    max_attempts = 200  # 1000  # Prevent infinite loop
+    def __init__(self, capacity=64):
+        self.capacity = 0
+        self.free = []
+        for name, code in self.COLUMNS.items():
+            setattr(self, name, array(code))
+        self.grow(capacity)
 
-    while attempts < max_attempts:
-        x = random.randint(border_distance, GRID_SIZE - 1 - border_distance)
-        y = random.randint(border_distance, GRID_SIZE - 1 - border_distance)
-        
-        # Check if the position is not in any player's territory
-        if all((x, y) not in entity.territory for entity in existing_entities if not isinstance(entity, Bot)):
-            # Check distance from existing entities
-            if all(distance((x, y), (e.x, e.y)) >= MIN_SPAWN_DISTANCE for e in existing_entities):
-                # If it's not in a bot's territory, return immediately
-                if not any((x, y) in entity.territory for entity in existing_entities if isinstance(entity, Bot)):
-                    return x, y
-                # If it's in a bot's territory, keep it as a potential position
-                potential_position = (x, y)
+    def grow(self, capacity):
+        for name, code in self.COLUMNS.items():
+            setattr(self, name, getattr(self, name) + array(code, bytes(array(code).itemsize * (capacity - self.capacity))))
+        self.free += range(capacity - 1, self.capacity - 1, -1)  # Lowest slots first
+        self.capacity = capacity
 
-        attempts += 1
+    def clear(self):
+        self.free = list(range(self.capacity - 1, -1, -1))
 
-    # If we couldn't find a position outside all territories, return the last potential position (in a bot's territory)
-    if 'potential_position' in locals():
-        return potential_position
+    def allocate(self, is_bot):
+        if not self.free:
+            self.grow(2 * self.capacity)
+        slot = self.free.pop()
+        for name in self.COLUMNS:
+            getattr(self, name)[slot] = 0
+        self.direction[slot] = self.last_direction[slot] = -1
+        self.is_bot[slot] = is_bot
+        return slot
 
-    # If we still couldn't find a position, fall back to the original method
-    return find_valid_spawn_position_original(existing_entities)
+    def release(self, slot):
+        self.free.append(slot)
 
+    def column(self, name):
+        return np.frombuffer(getattr(self, name), dtype=getattr(self, name).typecode)
 
-def find_valid_spawn_position_original(existing_entities):
-    border_distance = 3
-    while True:
-        x = random.randint(border_distance, GRID_SIZE - 1 - border_distance)
-        y = random.randint(border_distance, GRID_SIZE - 1 - border_distance)
-        if all(distance((x, y), (e.x, e.y)) >= MIN_SPAWN_DISTANCE for e in existing_entities):
-            return x, y
 
+class Trail:
+    # The cells of an entity's trail in the order they were entered (for drawing, captures and stepping back),
+    # with the same cells as a set next to them, so membership is one lookup whatever the trail's length.
+    # Trails only grow until they are cleared as a whole, so the set never has to forget a single cell
+    __slots__ = ('cells', 'members')
 
+    def __init__(self, cells=()):
+        self.cells = []
+        self.members = set()
+        for cell in cells:
+            self.append(cell)
 
-def darker_shade(color, factor=0.5):
-    return tuple(int(c * factor) for c in color)
+    def append(self, cell):
+        self.cells.append(cell)
+        self.members.add(cell)
+
+    def clear(self):
+        self.cells = []
+        self.members = set()
+
+    def __contains__(self, cell):
+        return cell in self.members
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __getitem__(self, index):
+        return self.cells[index]
+
+    def __eq__(self, other):
+        return self.cells == other.cells if isinstance(other, Trail) else NotImplemented
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.cells, dtype=dtype).reshape(-1, 2)
+
+    def __reduce__(self):
+        return Trail, (self.cells,)
+
+
+def stored(name):
+    # Property of an entity handle backed by its column in the entity store
+    def get(self):
+        return getattr(self.store, name)[self.slot]
+
+    def set(self, value):
+        getattr(self.store, name)[self.slot] = value
+    return property(get, set)
+
+
+def stored_flag(name):
+    def get(self):
+        return getattr(self.store, name)[self.slot] != 0
+
+    def set(self, value):
+        getattr(self.store, name)[self.slot] = bool(value)
+    return property(get, set)
+
+
+def stored_direction(name):
+    def get(self):
+        return DIRECTIONS[getattr(self.store, name)[self.slot]]
+
+    def set(self, value):
+        getattr(self.store, name)[self.slot] = DIRECTION_CODES[value]
+    return property(get, set)
 
 
 class Player:
-    next_id = 1
-    def __init__(self, x, y, color):
+    __slots__ = ('world', 'store', 'slot', 'name', 'color', 'trail_color', 'territory_color', 'trail', '_territory')
+    id = stored('id')
+    x = stored('x')
+    y = stored('y')
+    direction = stored_direction('direction')
+    last_direction = stored_direction('last_direction')
+    moving = stored_flag('moving')
+    change_direction_counter = stored('change_direction_counter')
+    trail_length = stored('trail_length')  # len(trail), kept next to it so the step can skip empty trails at once
+
+    def __init__(self, world, x, y, color):
+        self.world = world
+        self.store = world.entity_store
+        self.slot = self.store.allocate(isinstance(self, Bot))
         self.x = x
         self.y = y
         self.color = color
         self.trail_color = color
         self.territory_color = darker_shade(color)
-        self.territory = set((x + dx, y + dy) for dx in range(-2, 3) for dy in range(-2, 3))
-        self.trail = []
+        self.trail = Trail()
         self.moving = False
         self.direction = None
         self.last_direction = None
         self.change_direction_counter = 0
         self.name = "Player"
-        self.id = Player.next_id
-        Player.next_id += 1
+        self.id = world.new_entity_id()
+        self._territory = TerritoryView(world.ownership, self)
+        self._territory.update((x + dx, y + dy) for dx in range(-2, 3) for dy in range(-2, 3))
 
-    @staticmethod
-    def is_in_lethal_zone(x, y):
-        return x == 0 or x == GRID_SIZE - 1 or y == 0 or y == GRID_SIZE - 1
+    @classmethod
+    def blank(cls, world):
+        # A handle with a fresh slot in the world's entity store and nothing else set, for rebuilding
+        # entities without running the constructor (loading a game, decision workers)
+        entity = object.__new__(cls)
+        entity.world = world
+        entity.store = world.entity_store
+        entity.slot = entity.store.allocate(issubclass(cls, Bot))
+        return entity
+
+    @property
+    def territory(self):
+        return self._territory
+
+    @territory.setter
+    def territory(self, positions):
+        self.world.ownership.assign(self.id, positions)
+
+    def is_in_lethal_zone(self, x, y):
+        return x == 0 or x == self.world.grid_size - 1 or y == 0 or y == self.world.grid_size - 1
 
     def is_valid_move(self, x, y):
-        return (1 <= x < GRID_SIZE - 1 and 1 <= y < GRID_SIZE - 1 and 
+        return (1 <= x < self.world.grid_size - 1 and 1 <= y < self.world.grid_size - 1 and 
                 (x, y) not in self.trail)
 
     def is_safe_move(self, x, y):
@@ -281,38 +1493,31 @@ class Player:
                 self.last_direction[1] == -new_direction[1])
 
 
-    def move(self):
-        if self.direction and self.moving:
-            new_x = self.x + self.direction[0]
-            new_y = self.y + self.direction[1]
-            if not is_on_border(new_x, new_y):
-                self.x, self.y = new_x, new_y
-                if (self.x, self.y) not in self.territory:
-                    self.trail.append((self.x, self.y))
-            else:
-                self.moving = False
-
-
     def claim_territory(self, positions):
-        self.territory.update(positions)
-        for entity in all_entities:
-            if entity != self:
-                entity.territory -= set(positions)
+        # Writing our id into the grid takes the cells away from their previous owners;
+        # the returned delta lists exactly the cells that changed hands
+        return self.territory.update(positions)
 
 
 
     def expand_territory(self):
         if not self.trail:
-            return
+            return None
 
-        if len(self.trail) <= GRID_SIZE*2:
+        delta = None
+        if len(self.trail) <= self.world.grid_size*2:
             if not self.entities_inside_trail():
-                new_territory = set(self.trail)
-                self.fill_interior()
-                new_territory.update(self.territory - set(self.trail))
-                self.claim_territory(new_territory)
+                # The trail and everything it encloses are claimed in a single capture
+                new_territory = np.concatenate((np.array(self.trail, dtype=np.intp), self.fill_interior()))
+                delta = self.claim_territory(new_territory)
 
+        self.clear_trail()
+        return delta
+
+    def clear_trail(self):
+        self.world.trails.erase(self.trail, self.id)
         self.trail.clear()
+        self.trail_length = 0
 
 
     def entities_inside_trail(self):
@@ -324,66 +1529,20 @@ class Player:
 
     def fill_interior(self):
         if not self.trail:
-            return
+            return np.empty((0, 2), dtype=np.intp)
 
         # Find the bounding box of the trail
-        min_x = min(x for x, y in self.trail)
-        max_x = max(x for x, y in self.trail)
-        min_y = min(y for x, y in self.trail)
-        max_y = max(y for x, y in self.trail)
-
-        # Create a set of boundary points (trail + existing territory)
-        boundary = set(self.trail) | self.territory
-
-        # Find a point inside the trail to start the flood fill
-        start_point = None
-        for x in range(min_x, max_x + 1):
-            for y in range(min_y, max_y + 1):
-                if (x, y) not in boundary and self.is_point_inside((x, y)):
-                    start_point = (x, y)
-                    break
-            if start_point:
-                break
+        trail = np.array(self.trail, dtype=np.intp)
+        min_x, min_y = trail.min(axis=0)
+        max_x, max_y = trail.max(axis=0)
 
-        if not start_point:
-            return  # No interior point found
+        # Bitmap of the boundary (trail + existing territory) inside the bounding box
+        wall = self.world.ownership.owner.region(min_x, min_y, max_x + 1, max_y + 1) == self.id
+        wall[trail[:, 0] - min_x, trail[:, 1] - min_y] = True
 
-        # Perform flood fill
-        queue = deque([start_point])
-        filled = set()
-
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) in filled or (x, y) in boundary:
-                continue
-
-            filled.add((x, y))
-
-            # Check neighboring points
-            for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                nx, ny = x + dx, y + dy
-                if min_x <= nx <= max_x and min_y <= ny <= max_y:
-                    queue.append((nx, ny))
-
-        # Add the filled points to the territory
-        self.territory.update(filled)
-
-    def is_point_inside(self, point):
-        x, y = point
-        if (x, y) in self.territory or (x, y) in self.trail:
-            return False  # Point is already in territory or on the trail
-
-        # Cast a ray from the point to the right
-        intersections = 0
-        for i in range(len(self.trail)):
-            p1 = self.trail[i]
-            p2 = self.trail[(i + 1) % len(self.trail)]
-            if (p1[1] > y) != (p2[1] > y):
-                if x < (p2[0] - p1[0]) * (y - p1[1]) / (p2[1] - p1[1]) + p1[0]:
-                    intersections += 1
-
-        # If the number of intersections is odd, the point is inside
-        return intersections % 2 == 1
+        # Every pocket the boundary cuts off from the edge of the box is claimed, not just the first one
+        xs, ys = np.nonzero(enclosed_cells(wall))
+        return np.column_stack((xs + min_x, ys + min_y))
 
     """
     def fill_interior(self):
@@ -420,37 +1579,8 @@ class Player:
         return intersections % 2 == 1
     """
 
-    def check_collision_with_trail(self, trail):
-        current_pos = (self.x, self.y)
-        return current_pos in trail
-
-
-    def check_collision_with_others_trail(self, other_entities):
-        current_pos = (self.x, self.y)
-        for other in other_entities:
-            if other != self and current_pos in other.trail:
-                return other
-        return None
-
-
-    def check_collision(self):
-        if len(self.trail) > 1:
-            head = (self.x, self.y)
-            if head in self.trail[:-1]:
-                return True
-        return False
-
-
     def is_in_own_territory(self):
-        return (self.x, self.y) in self.territory
-
-
-    def check_collision_with_others(self, other_entities):
-        current_pos = (self.x, self.y)
-        for other in other_entities:
-            if other != self and (current_pos in other.trail or current_pos in other.territory):
-                return other
-        return None
+        return self.world.ownership.owner_at(self.x, self.y) == self.id
 
 
     def draw(self, surface, offset_x, offset_y):
@@ -458,40 +1588,50 @@ class Player:
 
 
 class Bot(Player):
-    color_index = 0
-
-    @classmethod
-    def get_next_color(cls):
-        color = BOT_COLORS[cls.color_index % len(BOT_COLORS)]
-        cls.color_index += 1
-        return color
-
-    def __init__(self, x, y):
-        color = self.get_next_color()
-        super().__init__(x, y, color)
+    __slots__ = ('rng_seed', 'rng', 'path_cache')
+    change_direction_threshold = stored('change_direction_threshold')
+    trail_check_counter = stored('trail_check_counter')
+    trail_check_threshold = stored('trail_check_threshold')
+    trail_check_distance = stored('trail_check_distance')
+    max_trail_length = stored('max_trail_length')
+    aggression = stored('aggression')
+    base_aggression = stored('base_aggression')
+    # Everything decide_move() may read or change, minus the world links and the generator; see BotDecisionPool
+    DECISION_FIELDS = ('id', 'x', 'y', 'trail', 'trail_length', 'moving', 'direction', 'last_direction',
+                       'change_direction_counter', 'path_cache') + BOT_STATE_FIELDS
+
+    def __init__(self, world, x, y):
+        color = world.next_bot_color()
+        super().__init__(world, x, y, color)
+        # Each bot draws from its own generator, seeded from the world's, so one bot's decisions
+        # never shift another bot's random numbers. It is reseeded from (rng_seed, tick) before every
+        # decision, so a decision can be replayed anywhere without carrying the generator's state
+        self.rng_seed = world.rng.getrandbits(64)
+        self.rng = random.Random(self.rng_seed)
         self.change_direction_counter = 0
         # self.change_direction_threshold = random.randint(7, 12)
-        self.change_direction_threshold = random.randint(2, 9)
+        self.change_direction_threshold = self.rng.randint(2, 9)
         self.trail_check_counter = 0
         # self.trail_check_threshold = random.randint(4, 5)
         # self.trail_check_distance = random.randint(2, 3)
-        self.trail_check_threshold = random.randint(1, 2)
-        self.trail_check_distance = random.randint(5, 6)
+        self.trail_check_threshold = self.rng.randint(1, 2)
+        self.trail_check_distance = self.rng.randint(5, 6)
         self.name = ""  # Will be set by ScoreManager
         # print(f"Bot created at ({x}, {y}) with color: {self.color}")
-        self.max_trail_length = random.randint(6, 18)  # 15, 25
-        self.aggression = random.uniform(0.2, 0.6)  # 0.5, 0.8
-        self.base_aggression = random.uniform(0.1, 0.9)  # Base personality factor: default (0.4, 0.6)
+        self.max_trail_length = self.rng.randint(6, 18)  # 15, 25
+        self.path_cache = None  # (goal, target, path) of the last planned path
+        self.aggression = self.rng.uniform(0.2, 0.6)  # 0.5, 0.8
+        self.base_aggression = self.rng.uniform(0.1, 0.9)  # Base personality factor: default (0.4, 0.6)
 
 
     """
     @staticmethod
     def is_on_border(x, y):
-        return x < 0 or x >= GRID_SIZE or y < 0 or y >= GRID_SIZE
+        return x < 0 or x >= self.world.grid_size or y < 0 or y >= self.world.grid_size
 
     @staticmethod
     def is_border_tile(x, y):
-        return x < 0 or x >= GRID_SIZE or y < 0 or y >= GRID_SIZE
+        return x < 0 or x >= self.world.grid_size or y < 0 or y >= self.world.grid_size
     """
 
 
@@ -515,15 +1655,20 @@ class Bot(Player):
         return (dx == 1 and dy == 0) or (dx == 0 and dy == 1)
 
 
-    def move(self):
+    def decide_move(self):
+        # Picks the next cell (or None to stay put). Reads the world but only changes this bot's own
+        # state, so all bots can decide against the same snapshot, in any order or in parallel
+        self.rng.seed((self.rng_seed << 32) + self.world.tick_count)
+        if not self.is_near_player():
+            return self.decide_move_far()
         self.trail_check_counter += 1
         if self.trail_check_counter >= self.trail_check_threshold:
             nearby_trail = self.find_nearby_trail()
             if nearby_trail:
                 self.target_nearby_trail(nearby_trail)
                 self.trail_check_counter = 0
-                self.trail_check_threshold = random.randint(4, 5)
-                self.trail_check_distance = random.randint(2, 3)
+                self.trail_check_threshold = self.rng.randint(4, 5)
+                self.trail_check_distance = self.rng.randint(2, 3)
             else:
                 self.change_direction_counter += 1
                 if self.change_direction_counter >= self.change_direction_threshold:
@@ -531,13 +1676,13 @@ class Bot(Player):
                     self.change_direction_counter = 0
                     
                     # Adjust change_direction_threshold based on nearest entity
-                    nearest_distance = self.find_nearest_entity(all_entities)
+                    nearest_distance = self.find_nearest_entity()
                     if nearest_distance < 10:
-                        self.change_direction_threshold = random.randint(3, 6)
+                        self.change_direction_threshold = self.rng.randint(3, 6)
                     elif nearest_distance < 20:
-                        self.change_direction_threshold = random.randint(5, 9)
+                        self.change_direction_threshold = self.rng.randint(5, 9)
                     else:
-                        self.change_direction_threshold = random.randint(7, 12)
+                        self.change_direction_threshold = self.rng.randint(7, 12)
         else:
             self.change_direction_counter += 1
             if self.change_direction_counter >= self.change_direction_threshold:
@@ -545,13 +1690,13 @@ class Bot(Player):
                 self.change_direction_counter = 0
                 
                 # Adjust change_direction_threshold based on nearest entity
-                nearest_distance = self.find_nearest_entity(all_entities)
+                nearest_distance = self.find_nearest_entity()
                 if nearest_distance < 10:
-                    self.change_direction_threshold = random.randint(3, 6)
+                    self.change_direction_threshold = self.rng.randint(3, 6)
                 elif nearest_distance < 20:
-                    self.change_direction_threshold = random.randint(5, 9)
+                    self.change_direction_threshold = self.rng.randint(5, 9)
                 else:
-                    self.change_direction_threshold = random.randint(7, 12)
+                    self.change_direction_threshold = self.rng.randint(7, 12)
 
         if self.is_about_to_trap_itself():
             self.find_best_path()
@@ -560,11 +1705,55 @@ class Bot(Player):
             new_x = self.x + self.direction[0]
             new_y = self.y + self.direction[1]
             if self.is_valid_move(new_x, new_y):
-                self.x, self.y = new_x, new_y
-                if (self.x, self.y) not in self.territory:
-                    self.trail.append((self.x, self.y))
-            else:
-                self.find_best_path()
+                return new_x, new_y
+            self.find_best_path()
+        return None
+
+    def is_near_player(self):
+        player = self.world.player
+        return max(abs(self.x - player.x), abs(self.y - player.y)) <= LOD_RADIUS
+
+    def decide_move_far(self):
+        # Cheap policy for bots out of the player's sight: go straight, turn at random now and then, and once the
+        # trail is long enough steer home every tick. No trail search, no path finding
+        if len(self.trail) > self.max_trail_length:
+            self.head_home()
+        elif not self.moving or self.is_about_to_trap_itself():
+            self.change_direction_randomly()
+        elif (self.world.tick_count + self.id) % LOD_INTERVAL == 0 and self.rng.random() < LOD_TURN_CHANCE:
+            self.change_direction()
+
+        if self.direction and self.moving:
+            new_x = self.x + self.direction[0]
+            new_y = self.y + self.direction[1]
+            if self.is_valid_move(new_x, new_y):
+                return new_x, new_y
+            self.change_direction_randomly()
+        return None
+
+    def head_home(self):
+        # Greedy step towards the territory cell the trail left from, a cheap stand-in for return_to_territory();
+        # falls back to that if the cell has been taken meanwhile
+        start_x, start_y = self.trail[0]
+        home = next(((start_x + dx, start_y + dy) for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]
+                     if (start_x + dx, start_y + dy) in self.territory), None)
+        if home is None:
+            return self.return_to_territory()
+        steps = [(abs(self.x + dx - home[0]) + abs(self.y + dy - home[1]), (dx, dy))
+                 for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]
+                 if self.is_valid_move(self.x + dx, self.y + dy) and not self.is_opposite_direction((dx, dy))]
+        if steps:
+            self.set_direction(min(steps)[1])
+            return True
+        self.change_direction_randomly()
+        return False
+
+    def decision_state(self):
+        return {field: getattr(self, field) for field in self.DECISION_FIELDS}
+
+    def load_decision_state(self, state):
+        for field, value in state.items():
+            setattr(self, field, value)
 
     # (most recent change [24-08-04]: make bots more dynamic, they should become more cautious when enemies are nearby)
 
@@ -580,20 +1769,20 @@ class Bot(Player):
             if nearby_trail:
                 self.target_nearby_trail(nearby_trail)
                 self.trail_check_counter = 0
-                self.trail_check_threshold = random.randint(4, 5)
-                self.trail_check_distance = random.randint(2, 3)
+                self.trail_check_threshold = self.rng.randint(4, 5)
+                self.trail_check_distance = self.rng.randint(2, 3)
             else:
                 self.change_direction_counter += 1
                 if self.change_direction_counter >= self.change_direction_threshold or not self.moving:
                     self.find_best_path()
                     self.change_direction_counter = 0
-                    self.change_direction_threshold = random.randint(7, 12)
+                    self.change_direction_threshold = self.rng.randint(7, 12)
         else:
             self.change_direction_counter += 1
             if self.change_direction_counter >= self.change_direction_threshold or not self.moving:
                 self.find_best_path()
                 self.change_direction_counter = 0
-                self.change_direction_threshold = random.randint(7, 12)
+                self.change_direction_threshold = self.rng.randint(7, 12)
 
         if self.is_about_to_trap_itself():
             # print(f"Bot at ({self.x}, {self.y}) detected potential self-trap, finding new path")
@@ -615,50 +1804,28 @@ class Bot(Player):
 
     def find_nearby_trail(self):
         check_distance = 3  # Reduced from 5
-        for dx in range(-check_distance, check_distance + 1):
-            for dy in range(-check_distance, check_distance + 1):
-                if dx == 0 and dy == 0:
-                    continue
-                check_x, check_y = self.x + dx, self.y + dy
-                if 0 <= check_x < GRID_SIZE and 0 <= check_y < GRID_SIZE:
-                    for entity in all_entities:
-                        if entity != self and (check_x, check_y) in entity.trail:
-                            return (check_x, check_y)
-        return None
+        hits = self.world.tactical.enemy_trails(self.x, self.y, self.id, check_distance)
+        return hits[0][2] if hits else None
 
 
     def find_nearby_trails(self):
-        nearby_trails = []
+        # One entry per enemy with trail in the window, so the bot rolls once per enemy whatever its trail's length
         check_distance = 5  # Adjust as needed
-        for entity in all_entities:
-            if entity != self:
-                for x in range(self.x - check_distance, self.x + check_distance + 1):
-                    for y in range(self.y - check_distance, self.y + check_distance + 1):
-                        if (x, y) in entity.trail:
-                            nearby_trails.append(((x, y), entity))
-                            break
-                    if nearby_trails:
-                        break
-        return nearby_trails
+        hits = self.world.tactical.enemy_trail_owners(self.x, self.y, self.id, check_distance)
+        return [(cell, self.world.by_id[owner_id]) for cell, owner_id in hits if owner_id in self.world.by_id]
 
 
     def target_nearby_trail(self, target):
         dx = target[0] - self.x
         dy = target[1] - self.y
-        if random.choice([True, False]):  # Randomly choose horizontal or vertical movement
+        if self.rng.choice([True, False]):  # Randomly choose horizontal or vertical movement
             self.set_direction((1 if dx > 0 else -1, 0) if dx != 0 else (0, 1 if dy > 0 else -1))
         else:
             self.set_direction((0, 1 if dy > 0 else -1) if dy != 0 else (1 if dx > 0 else -1, 0))
 
 
-    def find_nearest_entity(self, all_entities):
-        nearest_distance = float('inf')
-        for entity in all_entities:
-            if entity != self:
-                dist = ((self.x - entity.x) ** 2 + (self.y - entity.y) ** 2) ** 0.5
-                if dist < nearest_distance:
-                    nearest_distance = dist
-        return nearest_distance
+    def find_nearest_entity(self):
+        return self.world.tactical.nearest_enemy_head_distance(self.x, self.y, self.id)
 
 
     def is_about_to_trap_itself(self):
@@ -676,7 +1843,7 @@ class Bot(Player):
 
     """
     def is_valid_move(self, x, y):
-        return (0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE and 
+        return (0 <= x < self.world.grid_size and 0 <= y < self.world.grid_size and 
                 (x, y) not in self.trail)
 
     def is_safe_move(self, x, y):
@@ -686,15 +1853,14 @@ class Bot(Player):
     def check_potential_collision(self):
         # Check for potential head-on collisions
         if (self.x, self.y) not in self.territory:
-            for entity in all_entities:
-                if entity != self and abs(entity.x - self.x) <= 1 and abs(entity.y - self.y) <= 1:
-                    return True
+            # A radius of 1.5 covers exactly the 8 neighbouring tiles
+            return bool(self.world.spatial.within(self.x, self.y, 1.5, exclude=self))
         return False
 
 
     def avoid_collision(self):
         directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-        random.shuffle(directions)
+        self.rng.shuffle(directions)
         for dx, dy in directions:
             new_x, new_y = self.x + dx, self.y + dy
             if self.is_valid_move(new_x, new_y) and not self.check_potential_collision():
@@ -703,8 +1869,20 @@ class Bot(Player):
         self.moving = False
 
 
-    def is_far_from_territory(self, threshold=10):
-        return min((abs(self.x - tx) + abs(self.y - ty) for tx, ty in self.territory), default=0) > threshold
+    def home_field(self):
+        # Taken out and put back, so the dict's first entry is always the least recently used field
+        fields = self.world.home_fields
+        field = fields.pop(self.id, None)
+        if field is None or field.key != HomeField.key_for(self.world.ownership, self.id, self.x, self.y):
+            field = HomeField(self.world.ownership, self.id, self.x, self.y)
+        fields[self.id] = field
+        if len(fields) > HOME_FIELD_CACHE:
+            del fields[next(iter(fields))]
+        return field
+
+    def path_home(self):
+        # Shortest way back into the territory along the home field, None if the trail blocks it or home is too far
+        return self.home_field().path_home(self.x, self.y, self.is_safe_move)
 
 
     def find_expansion_target(self):
@@ -715,20 +1893,23 @@ class Bot(Player):
                 x, y = self.x + dx, self.y + dy
                 if self.is_safe_move(x, y) and (x, y) not in self.territory:
                     possible_targets.append((x, y))
-        return random.choice(possible_targets) if possible_targets else None
+        return self.rng.choice(possible_targets) if possible_targets else None
 
 
     """
     def is_near_border(self, x, y, distance=2):
-        return (x < distance or x >= GRID_SIZE - distance or 
-                y < distance or y >= GRID_SIZE - distance)
+        return (x < distance or x >= self.world.grid_size - distance or 
+                y < distance or y >= self.world.grid_size - distance)
     """
 
     def return_to_territory(self):
-        target = self.find_nearest_territory_edge()
-        if target:
-            path = self.bfs_path_to_target(target)
-            if path and len(path) > 1:
+        # The home field's path when it has one, else a search around the trail (or the way out when inside)
+        path = self.path_home() if (self.x, self.y) not in self.territory else None
+        if not path:
+            target = self.find_nearest_territory_edge()
+            path = self.path_to_target(target, 'home') if target else None
+        if path:
+            if len(path) > 1:
                 next_step = path[1]
                 if self.is_valid_orthogonal_move(self.x, self.y, next_step[0], next_step[1]) and self.is_safe_move(next_step[0], next_step[1]):
                     self.set_direction((next_step[0] - self.x, next_step[1] - self.y))
@@ -739,7 +1920,7 @@ class Bot(Player):
     def bot_expand_territory(self):
         target = self.find_expansion_target()
         if target:
-            path = self.bfs_path_to_target(target)
+            path = self.path_to_target(target, 'expand')
             if path and len(path) > 1:
                 next_step = path[1]
                 if self.is_valid_orthogonal_move(self.x, self.y, next_step[0], next_step[1]) and self.is_safe_move(next_step[0], next_step[1]):
@@ -751,7 +1932,7 @@ class Bot(Player):
 
 
     def find_best_path(self):
-        player = next(entity for entity in all_entities if isinstance(entity, Player) and not isinstance(entity, Bot))
+        player = self.world.player
         
         # Always consider returning to territory if trail is too long
         if len(self.trail) > self.max_trail_length:
@@ -761,11 +1942,11 @@ class Bot(Player):
         nearby_trails = self.find_nearby_trails()
         for trail, owner in nearby_trails:
             aggression = self.calculate_aggression(owner)
-            if random.random() < aggression:
+            if self.rng.random() < aggression:
                 return self.move_towards_trail(trail)
 
         # If no trails to pursue, consider expanding or moving towards the player
-        if self.distance_to(player) <= PROXIMITY_THRESHOLD and random.random() < self.calculate_aggression(player):
+        if self.distance_to(player) <= PROXIMITY_THRESHOLD and self.rng.random() < self.calculate_aggression(player):
             return self.move_towards_entity(player)
         else:
             return self.bot_expand_territory()
@@ -788,7 +1969,7 @@ class Bot(Player):
 
 
     def move_towards_entity(self, entity):
-        path = self.bfs_path_to_target((entity.x, entity.y))
+        path = self.path_to_target((entity.x, entity.y), 'player')
         if path and len(path) > 1:
             next_step = path[1]
             if self.is_valid_orthogonal_move(self.x, self.y, next_step[0], next_step[1]) and self.is_safe_move(next_step[0], next_step[1]):
@@ -827,13 +2008,14 @@ class Bot(Player):
 
 
     def find_nearest_territory_edge(self):
+        # Only asked once path_home() came up empty: the home field ignores the trail, so when the trail
+        # is in the way, search around it
         if (self.x, self.y) in self.territory:
             return self.find_territory_exit()
-
         queue = deque([(self.x, self.y, 0)])
         visited = set()
 
-        while queue:
+        while queue and len(visited) < PATH_NODE_BUDGET:
             x, y, dist = queue.popleft()
             if (x, y) in visited:
                 continue
@@ -855,37 +2037,43 @@ class Bot(Player):
             nx, ny = self.x + dx, self.y + dy
             if self.is_valid_move(nx, ny) and (nx, ny) not in self.territory:
                 return (nx, ny)
-        return None
-
-
-    def bfs_path_to_target(self, target):
-        queue = deque([(self.x, self.y)])
-        visited = set([(self.x, self.y)])
-        parent = {}
-
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) == target:
-                path = []
-                while (x, y) != (self.x, self.y):
-                    path.append((x, y))
-                    x, y = parent[(x, y)]
-                path.append((self.x, self.y))
-                return path[::-1]
-
-            for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                nx, ny = x + dx, y + dy
-                if self.is_safe_move(nx, ny) and (nx, ny) not in visited and self.is_valid_orthogonal_move(x, y, nx, ny):
-                    queue.append((nx, ny))
-                    visited.add((nx, ny))
-                    parent[(nx, ny)] = (x, y)
-
-        return None
+        # Deep inside: head for the nearest cell on the boundary first
+        path = self.home_field().path_to_boundary(self.x, self.y, self.is_valid_move)
+        return path[-1] if path and len(path) > 1 else None
+
+
+    def path_to_target(self, target, goal):
+        # Follow the cached path for the same kind of goal while its target is within PATH_SLACK of the new one
+        # and nothing blocks the rest of it. Bots go straight between two decisions, so they may have left the
+        # path by the time they ask again; a path cell next to the bot is as good as being on it
+        if self.path_cache and self.path_cache[0] == goal:
+            _, cached_target, path = self.path_cache
+            if abs(cached_target[0] - target[0]) + abs(cached_target[1] - target[1]) <= PATH_SLACK[goal]:
+                remaining = self.rejoin_path(path)
+                if remaining and all(self.is_safe_move(x, y) for x, y in remaining[1:]):
+                    self.path_cache = (goal, cached_target, remaining)
+                    return remaining
+
+        path = astar_path((self.x, self.y), target, self.is_safe_move)
+        self.path_cache = (goal, target, path) if path and len(path) > 1 else None
+        return path
+
+    def rejoin_path(self, path):
+        # The rest of the path from the bot's cell, or from the furthest path cell next to it; None if neither
+        # leaves a step to take
+        here = (self.x, self.y)
+        for i in range(len(path) - 1, 0, -1):
+            x, y = path[i]
+            if (x, y) == here:
+                return path[i:] if i < len(path) - 1 else None
+            if abs(x - self.x) + abs(y - self.y) == 1:
+                return [here] + path[i:]
+        return path if path[0] == here and len(path) > 1 else None
 
 
     def change_direction_randomly(self):
         directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-        random.shuffle(directions)
+        self.rng.shuffle(directions)
         for direction in directions:
             new_x, new_y = self.x + direction[0], self.y + direction[1]
             if self.is_valid_move(new_x, new_y):
@@ -895,7 +2083,7 @@ class Bot(Player):
 
 
     def move_towards_center(self):
-        center_x, center_y = GRID_SIZE // 2, GRID_SIZE // 2
+        center_x, center_y = self.world.grid_size // 2, self.world.grid_size // 2
         dx = center_x - self.x
         dy = center_y - self.y
         if abs(dx) > abs(dy):
@@ -910,7 +2098,7 @@ class Bot(Player):
             opposite = (-self.direction[0], -self.direction[1])
             if opposite in possible_directions:
                 possible_directions.remove(opposite)
-        new_direction = random.choice(possible_directions)
+        new_direction = self.rng.choice(possible_directions)
         self.set_direction(new_direction)
         # print(f"Bot changed direction to {self.direction}")
 
@@ -926,7 +2114,7 @@ class Bot(Player):
             next_pos = (self.x + self.direction[0] * i, self.y + self.direction[1] * i)
             # print(f"Bot at ({self.x}, {self.y}) checking future position {next_pos}")
             
-            if next_pos in self.trail or not (0 <= next_pos[0] < GRID_SIZE and 0 <= next_pos[1] < GRID_SIZE):
+            if next_pos in self.trail or not (0 <= next_pos[0] < self.world.grid_size and 0 <= next_pos[1] < self.world.grid_size):
                 # print(f"Bot at ({self.x}, {self.y}) detected potential collision at {next_pos}")
                 self.change_direction_to_avoid_collision()
                 return
@@ -951,7 +2139,7 @@ class Bot(Player):
     def is_safe_direction(self, direction):
         for i in range(1, 4):  # Check 3 steps ahead
             next_pos = (self.x + direction[0] * i, self.y + direction[1] * i)
-            if next_pos in self.trail or not (0 <= next_pos[0] < GRID_SIZE and 0 <= next_pos[1] < GRID_SIZE):
+            if next_pos in self.trail or not (0 <= next_pos[0] < self.world.grid_size and 0 <= next_pos[1] < self.world.grid_size):
                 return False
         return True
 
@@ -962,7 +2150,7 @@ class Bot(Player):
         while steps < 10:  # Limit the number of steps to check
             next_pos = (current_pos[0] + direction[0], current_pos[1] + direction[1])
             # print(f"Checking position {next_pos}")
-            if next_pos in self.trail or not (0 <= next_pos[0] < GRID_SIZE and 0 <= next_pos[1] < GRID_SIZE):
+            if next_pos in self.trail or not (0 <= next_pos[0] < self.world.grid_size and 0 <= next_pos[1] < self.world.grid_size):
                 # print(f"Hit trail or boundary at {next_pos}")
                 return False
             if next_pos in self.territory:
@@ -989,15 +2177,64 @@ class Bot(Player):
 
 #------------------------------------------------------------------------------------------
 
-def respawn_bot(dead_bot, existing_entities):
-    x, y = find_valid_spawn_position(existing_entities)
-    new_bot = Bot(x, y)
+def respawn_bot(world, dead_bot):
+    x, y = find_valid_spawn_position(world)
+    new_bot = Bot(world, x, y)
     return new_bot
 #------------------------------------------------------------------------------------------------------------------------------------
 
+class FenwickTree:
+    # Counts per non-negative integer key, with O(log n) prefix sums and k-th smallest key lookups.
+    # The size stays a power of two and doubles whenever a bigger key comes in
+    def __init__(self, size=1024):
+        self.tree = [0] * (size + 1)
+
+    def add(self, key, count):
+        i = key + 1
+        while len(self.tree) <= i:
+            # The new top node covers the whole old tree, every other new node starts empty
+            size = len(self.tree) - 1
+            total = self.tree[size]
+            self.tree.extend([0] * size)
+            self.tree[2 * size] = total
+        while i < len(self.tree):
+            self.tree[i] += count
+            i += i & -i
+
+    def prefix(self, key):
+        # Number of counted keys <= key
+        i = min(key + 1, len(self.tree) - 1)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.tree[-1]
+
+    def kth(self, k):
+        # Smallest key with prefix(key) >= k, for 1 <= k <= total()
+        position = 0
+        step = len(self.tree) - 1
+        while step:
+            if self.tree[position + step] < k:
+                position += step
+                k -= self.tree[position]
+            step >>= 1
+        return position
+
+
 class ScoreManager:
+    # Score = territory area + kill bonus. Scores only change on captures, kills and respawns: the ownership
+    # grid reports whose area changed, and only those entities are rescored. The ranking is a Fenwick tree
+    # counting entities per score plus the names at each score, so rank and top-n queries are O(log n)
     def __init__(self):
         self.scores = {}
+        self.entities = {}  # name -> entity
+        self.bonus = {}  # name -> kill bonus
+        self.ranking = FenwickTree()
+        self.names_by_score = {}  # score -> {name: None}, in the order the names reached that score
         self.greek_letters = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', 
                               'lambda', 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 
                               'phi', 'chi', 'psi', 'omega']
@@ -1018,24 +2255,72 @@ class ScoreManager:
         else:
             name = f"Player_{entity.id}"
         entity.name = name
-        self.scores[name] = 25  # Starting score, from 5x5 starting-territory
+        self.add_entity(entity, 0)
 
+    def add_entity(self, entity, bonus):
+        self.entities[entity.name] = entity
+        self.bonus[entity.name] = bonus
+        self.set_score(entity.name, entity.world.ownership.area(entity.id) + bonus)
 
-    def update_score(self, entity):
-        self.scores[entity.name] = len(entity.territory)
+    def restore(self, entities, scores):
+        # Scores of a loaded game: the kill bonus is whatever the saved score has on top of the area
+        for entity in entities:
+            self.add_entity(entity, scores[entity.name] - entity.world.ownership.area(entity.id))
 
-    def add_kill_score(self, killer):
-        self.scores[killer.name] += 50
+    def remove(self, entity):
+        name = entity.name
+        self._unrank(name)
+        del self.scores[name], self.entities[name], self.bonus[name]
+
+    def set_score(self, name, score):
+        if self.scores.get(name) == score:
+            return
+        self._unrank(name)
+        self.scores[name] = score
+        self.names_by_score.setdefault(score, {})[name] = None
+        self.ranking.add(score, 1)
+
+    def _unrank(self, name):
+        score = self.scores.get(name)
+        if score is not None:
+            names = self.names_by_score[score]
+            del names[name]
+            if not names:
+                del self.names_by_score[score]
+            self.ranking.add(score, -1)
+
+    def update_scores(self, ownership, by_id):
+        # Rescore the entities whose area changed since the last call
+        for owner_id in ownership.changed_owners:
+            entity = by_id.get(owner_id)
+            if entity is not None and entity.name in self.entities:
+                self.set_score(entity.name, ownership.area(owner_id) + self.bonus[entity.name])
+        ownership.changed_owners.clear()
 
-    def reset_bot_score(self, bot):
-        self.scores[bot.name] = 25
+    def add_kill_score(self, killer):
+        self.bonus[killer.name] += 50
+        self.set_score(killer.name, self.scores[killer.name] + 50)
+
+    def rank(self, entity):
+        # 1 for the highest score; entities with equal scores share a rank
+        return self.ranking.total() - self.ranking.prefix(self.scores[entity.name]) + 1
+
+    def top(self, count):
+        top_scores = []
+        position = self.ranking.total()
+        while position > 0 and len(top_scores) < count:
+            score = self.ranking.kth(position)
+            names = self.names_by_score[score]
+            top_scores += [(name, score) for name in names]
+            position -= len(names)
+        return top_scores[:count]
 
     def get_top_25_scores(self):
-        return sorted(self.scores.items(), key=lambda x: x[1], reverse=True)[:25]
+        return self.top(25)
 
 #------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # Modify the draw_score_table function
-def draw_score_table(screen, score_manager, entities):
+def draw_score_table(screen, score_manager):
     global last_score_update_time, cached_score_surface, last_scores
     current_time = time.time()
     
@@ -1068,8 +2353,7 @@ def draw_score_table(screen, score_manager, entities):
                 if name.startswith("Player"):
                     color = GREEN_100
                 else:
-                    # Find the corresponding bot
-                    bot = next((b for b in bots if b.name == name), None)
+                    bot = score_manager.entities.get(name)
                     color = bot.color if bot else (200, 200, 200)  # Default color if bot not found
 
                 # Clear the previous score
@@ -1104,30 +2388,61 @@ def ensure_contrasting_color(color, bg_color):
     return color
 """
 
-def draw_radar(screen, territories):
-    radar = pygame.Surface((SHRUNKEN_RADAR_SIZE, SHRUNKEN_RADAR_SIZE))
-    radar.fill(RADAR_BACKGROUND_COLOR)
-    radar_scale = SHRUNKEN_RADAR_SIZE / GRID_SIZE
-
-    # Draw all territories on radar
-    for entity, territory in territories.items():
-        for x, y in territory:
-            pygame.draw.rect(radar, RADAR_TERRITORY_COLOR,
-                             (int(x * radar_scale), int(y * radar_scale),
-                              max(1, int(radar_scale)), max(1, int(radar_scale))))
-
-    # Add a border to the radar
-    pygame.draw.rect(radar, (0, 0, 0), radar.get_rect(), 1)
-
-    # Calculate the new position for the radar
-    radar_x = VIEWPORT_SIZE + RADAR_SHRINK
-    radar_y = 0  # Keep it at the top of the screen
-
-    # Blit the radar onto the screen at the new position
-    screen.blit(radar, (radar_x, radar_y))
-
-
-def draw_viewport_border(screen, offset_x, offset_y):
+class RadarRenderer:
+    # The radar image is a gather of the ownership grid through a precomputed pixel -> cell map and a
+    # color table per owner id, blitted with surfarray and only rebuilt every refresh_frames frames
+    def __init__(self, sim, refresh_frames=RADAR_REFRESH_FRAMES, owner_colors=RADAR_OWNER_COLORS):
+        self.sim = sim
+        self.refresh_frames = max(1, refresh_frames)
+        self.owner_colors = owner_colors
+        self.surface = pygame.Surface((SHRUNKEN_RADAR_SIZE, SHRUNKEN_RADAR_SIZE))
+        self.frames_until_refresh = 0
+
+        # Same footprint as drawing a max(1, int(scale)) square at int(cell * scale) for every cell;
+        # pixels that no cell covers map to -1
+        radar_scale = SHRUNKEN_RADAR_SIZE / sim.grid_size
+        width = max(1, int(radar_scale))
+        self.cell_of_pixel = np.full(SHRUNKEN_RADAR_SIZE, -1, dtype=np.intp)
+        for cell in range(sim.grid_size):
+            start = int(cell * radar_scale)
+            self.cell_of_pixel[start:start + width] = cell
+
+    def color_table(self):
+        top = max([self.sim.ownership.owner.max()] + list(self.sim.by_id)) + 2
+        colors = np.tile(np.array(RADAR_TERRITORY_COLOR, dtype=np.uint8), (top, 1))
+        if self.owner_colors:
+            for entity in self.sim.all_entities:
+                colors[entity.id] = entity.color
+        colors[0] = RADAR_BACKGROUND_COLOR
+        colors[-1] = RADAR_BACKGROUND_COLOR  # pixels outside every cell
+        return colors
+
+    def refresh(self):
+        colors = self.color_table()
+        # Pixels over never-written chunks read 0 without touching the arena
+        owner = self.sim.ownership.owner.take(self.cell_of_pixel[:, None], self.cell_of_pixel[None, :])
+        uncovered = (self.cell_of_pixel[:, None] < 0) | (self.cell_of_pixel[None, :] < 0)
+        owner[uncovered] = len(colors) - 1
+        pygame.surfarray.blit_array(self.surface, colors[owner])
+
+        # Add a border to the radar
+        pygame.draw.rect(self.surface, (0, 0, 0), self.surface.get_rect(), 1)
+
+    def draw(self, screen):
+        if self.frames_until_refresh <= 0:
+            self.refresh()
+            self.frames_until_refresh = self.refresh_frames
+        self.frames_until_refresh -= 1
+
+        # Calculate the new position for the radar
+        radar_x = VIEWPORT_SIZE + RADAR_SHRINK
+        radar_y = 0  # Keep it at the top of the screen
+
+        # Blit the radar onto the screen at the new position
+        screen.blit(self.surface, (radar_x, radar_y))
+
+
+def draw_viewport_border(screen, offset_x, offset_y, grid_size=GRID_SIZE):
     border_color = (0, 0, 0)  # Black for the viewport frame
     border_width = 2
     pygame.draw.rect(screen, border_color, (0, 0, VIEWPORT_SIZE, VIEWPORT_SIZE), border_width)
@@ -1137,16 +2452,16 @@ def draw_viewport_border(screen, offset_x, offset_y):
 
     # Calculate and draw only the visible borders
     left_visible = offset_x <= 1
-    right_visible = offset_x + VIEWPORT_TILES >= GRID_SIZE - 1
+    right_visible = offset_x + VIEWPORT_TILES >= grid_size - 1
     top_visible = offset_y <= 1
-    bottom_visible = offset_y + VIEWPORT_TILES >= GRID_SIZE - 1
+    bottom_visible = offset_y + VIEWPORT_TILES >= grid_size - 1
 
     if top_visible:
         y_pos = max(0, 1 - offset_y) * TILE_SIZE
         pygame.draw.line(screen, bright_red, (0, y_pos), (VIEWPORT_SIZE, y_pos), border_line_width)
     
     if bottom_visible:
-        y_pos = min(VIEWPORT_SIZE, (GRID_SIZE - 1 - offset_y) * TILE_SIZE)
+        y_pos = min(VIEWPORT_SIZE, (grid_size - 1 - offset_y) * TILE_SIZE)
         pygame.draw.line(screen, bright_red, (0, y_pos), (VIEWPORT_SIZE, y_pos), border_line_width)
     
     if left_visible:
@@ -1154,240 +2469,783 @@ def draw_viewport_border(screen, offset_x, offset_y):
         pygame.draw.line(screen, bright_red, (x_pos, 0), (x_pos, VIEWPORT_SIZE), border_line_width)
     
     if right_visible:
-        x_pos = min(VIEWPORT_SIZE, (GRID_SIZE - 1 - offset_x) * TILE_SIZE)
+        x_pos = min(VIEWPORT_SIZE, (grid_size - 1 - offset_x) * TILE_SIZE)
         pygame.draw.line(screen, bright_red, (x_pos, 0), (x_pos, VIEWPORT_SIZE), border_line_width)
 
 
-# Initialize game state -------------------------------------------------------------------------------------------------------------------------------------------
-player_x, player_y = find_valid_spawn_position([])  # Empty list as there are no existing entities yet
-player = Player(player_x, player_y, GREEN_100)
-bots = []
-all_entities = [player]
-
-for i in range(NUM_BOTS):
-    x, y = find_valid_spawn_position(all_entities)
-    bot = Bot(x, y)
-    bots.append(bot)
-    all_entities.append(bot)
-
-
-# Initialize the ScoreManager
-score_manager = ScoreManager()
-
-
-# Create a dictionary to store all territories
-territories = {entity: entity.territory for entity in all_entities}
-
-
-def resolve_territory_conflicts():
-    for entity in all_entities:
-        entity.territory = set(pos for pos in entity.territory if all(pos not in other.territory for other in all_entities if other != entity))
-
-
-for entity in all_entities:
-    score_manager.initialize_score(entity)
-
-
-# Main game loop --------------------------------------------------------------------------------------------------------------------------------------------------
-running = True
-clock = pygame.time.Clock()
-
-while running:
-    frame_counter += 1  # Increment the frame counter each iteration
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
-                running = False
-            elif event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT):
-                if game_paused:
-                    game_paused = False
-                    print("Game resumed!")
-                elif not game_started:
-                    game_started = True
-                    print("Game started!")
-                player.moving = True
-                if event.key == pygame.K_UP:
-                    player.set_direction((0, -1))
-                elif event.key == pygame.K_DOWN:
-                    player.set_direction((0, 1))
-                elif event.key == pygame.K_LEFT:
-                    player.set_direction((-1, 0))
-                elif event.key == pygame.K_RIGHT:
-                    player.set_direction((1, 0))
-            elif event.key == pygame.K_p:
-                player.moving = False
-            elif event.key == pygame.K_h:
-                game_paused = not game_paused
-                if game_paused:
-                    print("Game paused. Press any arrow key to resume.")
-                else:
-                    print("Game resumed!")
-            elif event.key == pygame.K_s:
-                game_paused = True
-                save_game(player, bots, score_manager, territories)
-                print("Game saved and paused. Press any arrow key to resume.")
-            elif event.key == pygame.K_l:
-                loaded_state = load_game()
-                if loaded_state:
-                    player, bots, score_manager, territories = loaded_state
-                    all_entities = [player] + bots
-                    game_started = True
-                    game_paused = True
-                    print("Game loaded and paused. Press any arrow key to resume.")
-
-    #--------------------------------------------------------------------------------------
-    # After the event handling, in your main game loop:
-    if not game_paused and game_started:       
-        if frame_counter % 2 == 0:  # Only move on even frames
-            # Update game state
-            for entity in all_entities:
-                entity.move()
-
-
-        # Handle territory expansion and conflicts
-        for entity in all_entities:
-            if (entity.x, entity.y) in entity.territory:
-                entity.expand_territory()
-            
-            # Update the territories dictionary
-            territories[entity] = entity.territory
-
-        # Resolve territory conflicts
-        for entity in all_entities:
-            entity.territory = set(pos for pos in entity.territory if all(pos not in other.territory or other == entity for other in all_entities))
-            territories[entity] = entity.territory
-
-
-        # After moving all entities
-        color_count = {}
-        for entity in all_entities:
-            if entity.color in color_count:
-                pass
-                # print(f"Warning: Duplicate color {entity.color} found for entities {color_count[entity.color]} and {entity.name}")
-            else:
-                color_count[entity.color] = entity.name
-
-
-        # Check for collisions
-        entities_to_remove = []
-        for entity in all_entities:
-            # Check for self-collision or entering lethal zone
-            if entity.check_collision_with_trail(entity.trail[:-1]) or entity.is_in_lethal_zone(entity.x, entity.y):
-                entities_to_remove.append(entity)
-            else:
-                # Check for collision with other entities' trails
-                collided_with = entity.check_collision_with_others_trail(all_entities)
-                if collided_with:
-                    entities_to_remove.append(collided_with)  # The owner of the trail dies
-                    score_manager.add_kill_score(entity)  # The entity that hit the trail gets the kill score
-
-
+# Game state ------------------------------------------------------------------------------------------------------------------------------------------------------
+class PhaseTimer:
+    # Wall time of every phase of Simulation.step(), one sample per tick; attach one as sim.phase_timer
+    def __init__(self):
+        self.samples = {}
+        self.last_time = 0.0
+
+    def start(self):
+        self.last_time = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.record(phase, now - self.last_time)
+        self.last_time = now
+
+    def record(self, phase, seconds):
+        self.samples.setdefault(phase, []).append(seconds)
+
+
+class Simulation:
+    # Owns the whole game state and advances it one tick per step(); needs no display at all.
+    # Every random choice is drawn from self.rng, so the seed and the player's inputs fix the whole match
+    def __init__(self, grid_size=GRID_SIZE, num_bots=NUM_BOTS, spawn=True, seed=None):
+        self.grid_size = grid_size
+        self.num_bots = num_bots
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.bot_colors = generate_unique_colors(num_bots, self.rng)
+        self.bot_color_index = 0
+        self.last_entity_id = 0
+        self.input_log = []  # (tick, input code) for every player input; None when the match can't be replayed
+        self.ownership = OwnershipGrid(grid_size)
+        self.trails = TrailGrid(grid_size)
+        self.spatial = SpatialHash()
+        self.spawn_index = SpawnIndex(self)
+        self.tactical = TacticalField(grid_size)
+        self.score_manager = ScoreManager()
+        self.entity_store = EntityStore()
+        self.home_fields = {}  # Bot id -> its HomeField, for the HOME_FIELD_CACHE bots that asked last
+        self.player = None
+        self.bots = []
+        self.all_entities = []
+        self.by_id = {}
+        self.tick_count = 0
+        self.game_over = False
+        self.phase_timer = None
+        self.decision_pool = None  # BotDecisionPool to run the bots' decisions on other cores
+        if spawn:
+            self.spawn_entities(num_bots)
+
+    def spawn_entities(self, num_bots):
+        player_x, player_y = find_valid_spawn_position(self)
+        self.player = Player(self, player_x, player_y, GREEN_100)
+        self.all_entities = [self.player]
+        self.spatial.insert(self.player)
+        self.spawn_index.add(self.player)
+
+        for i in range(num_bots):
+            x, y = find_valid_spawn_position(self)
+            bot = Bot(self, x, y)
+            self.bots.append(bot)
+            self.all_entities.append(bot)
+            self.spatial.insert(bot)
+            self.spawn_index.add(bot)
+
+        self.by_id = {entity.id: entity for entity in self.all_entities}
+
+        for entity in self.all_entities:
+            self.score_manager.initialize_score(entity)
+
+    def new_entity_id(self):
+        self.last_entity_id += 1
+        return self.last_entity_id
+
+    def next_bot_color(self):
+        color = self.bot_colors[self.bot_color_index % len(self.bot_colors)]
+        self.bot_color_index += 1
+        return color
 
-        # Handle head-on collisions
-        for i, entity1 in enumerate(all_entities):
-            for entity2 in all_entities[i+1:]:
-                if (entity1.x, entity1.y) == (entity2.x, entity2.y):
+    def apply_player_input(self, player_input):
+        # Inputs are logged against the number of ticks already run, i.e. they apply before the next tick
+        if self.input_log is not None and player_input in INPUT_CODES:
+            self.input_log.append((self.tick_count, INPUT_CODES[player_input]))
+        if player_input == PLAYER_STOP:
+            self.player.moving = False
+        elif player_input:
+            self.player.moving = True
+            self.player.set_direction(player_input)
+
+    def step(self, player_input=None):
+        timer = self.phase_timer
+        if timer:
+            timer.start()
+        if player_input is not None:
+            self.apply_player_input(player_input)
+        self.tick_count += 1
+
+        all_entities = self.all_entities
+        self.spatial.rebuild(all_entities)
+        # Only bots near the player read the field (see Bot.is_near_player), so only their surroundings are built
+        xs, ys = self.entity_columns(self.bots, 'x', 'y')
+        near = np.maximum(np.abs(xs - self.player.x), np.abs(ys - self.player.y)) <= LOD_RADIUS
+        self.tactical.update(self, xs[near], ys[near])
+        if timer:
+            timer.lap("fields")
+
+        # Every bot decides against the world as it was at the start of the tick, then all moves are applied
+        player = self.player
+        moves = []
+        if player.direction and player.moving:
+            moves.append((player, (player.x + player.direction[0], player.y + player.direction[1])))
+        moves += [(bot, target) for bot, target in zip(self.bots, self.decide_bot_moves()) if target is not None]
+        moved, new_trail_cells = self.move_entities(moves)
+        if timer:
+            timer.lap("move")
+
+        # Handle territory expansion; a capture only touches the previous owners of the captured cells,
+        # so there are no territory conflicts left to resolve afterwards. Only entities with a trail can expand;
+        # their in-territory flags come from one lookup, and are only looked up again one by one once a
+        # capture may have changed them
+        captured = False
+        trail_lengths, = self.entity_columns(all_entities, 'trail_length')
+        expanding = [all_entities[i] for i in np.flatnonzero(trail_lengths).tolist()]
+        for entity, inside in zip(expanding, self.in_own_territory(expanding).tolist()):
+            if entity.is_in_own_territory() if captured else inside:
+                delta = entity.expand_territory()
+                captured = captured or bool(delta is not None and len(delta))
+        if timer:
+            timer.lap("expand")
+
+        events = self.detect_collisions(moved)
+        if timer:
+            timer.lap("collisions")
+        removed = self.resolve_collisions(events)
+
+        # The trail cells entered this step only become obstacles now that the collision check is done
+        for entity in new_trail_cells:
+            if entity not in removed and entity.trail:
+                x, y = entity.trail[-1]
+                self.trails.mark(x, y, entity.id)
+        if timer:
+            timer.lap("resolve")
+
+        self.score_manager.update_scores(self.ownership, self.by_id)
+        if timer:
+            timer.lap("scoring")
+        return not self.game_over
+
+    def entity_columns(self, entities, *columns):
+        # The given entity store columns for these entities, as numpy arrays in their order
+        slots = np.array([entity.slot for entity in entities], dtype=np.intp)
+        return [self.entity_store.column(column)[slots] for column in columns]
+
+    def in_own_territory(self, entities):
+        if not entities:
+            return np.zeros(0, dtype=bool)
+        xs, ys, ids = self.entity_columns(entities, 'x', 'y', 'id')
+        return self.ownership.owner.take(xs, ys) == ids
+
+    def move_entities(self, moves):
+        # Batched movement: moves lists (entity, cell it steps to) for this tick. Entities stepping off the map stop
+        # instead, everybody else's position is written to the entity store in one go, and those that end up
+        # outside their own territory extend their trail. Returns the entities that moved and, in the same order,
+        # the ones whose trail got a new cell
+        if not moves:
+            return set(), []
+        entities = [entity for entity, _ in moves]
+        slots = np.array([entity.slot for entity in entities], dtype=np.intp)
+        cells = np.array([cell for _, cell in moves], dtype=np.intp).reshape(-1, 2)
+        on_map = ((cells >= 0) & (cells < self.grid_size)).all(axis=1)
+        self.entity_store.column('moving')[slots[~on_map]] = False
+
+        slots, cells = slots[on_map], cells[on_map]
+        self.entity_store.column('x')[slots] = cells[:, 0]
+        self.entity_store.column('y')[slots] = cells[:, 1]
+        entities = [entity for entity, keep in zip(entities, on_map.tolist()) if keep]
+        outside = self.ownership.owner.take(cells[:, 0], cells[:, 1]) != self.entity_store.column('id')[slots]
+        self.entity_store.column('trail_length')[slots[outside]] += 1
+        new_trail_cells = []
+        for i in np.flatnonzero(outside).tolist():
+            entity = entities[i]
+            entity.trail.append((entity.x, entity.y))
+            new_trail_cells.append(entity)
+        return set(entities), new_trail_cells
+
+    def decide_bot_moves(self):
+        if self.decision_pool is not None:
+            return self.decision_pool.decide(self)
+        return [bot.decide_move() for bot in self.bots]
+
+    def detect_collisions(self, moved):
+        # One pass over all entities: lethal border, own-trail and enemy-trail hits are grid lookups at the
+        # head, head-on collisions are found by grouping the heads per cell. Events come out in entity order:
+        # (kind, victim, killer) with kind in "lethal", "self", "cut", "head_on" and ("blocked", entity1, entity2)
+        # The masks and lookups are computed for all heads at once, only the entities they flag are visited
+        by_id = self.by_id
+        entities = self.all_entities
+        xs, ys, ids = self.entity_columns(entities, 'x', 'y', 'id')
+        edge = self.grid_size - 1
+        lethal = (xs == 0) | (xs == edge) | (ys == 0) | (ys == edge)
+        trail_ids = self.trails.owner.take(xs, ys)
+        events = []
+        for i in np.flatnonzero(lethal | (trail_ids != 0)).tolist():
+            entity = entities[i]
+            if lethal[i]:
+                events.append(("lethal", entity, None))
+            elif entity in moved:
+                owner_id = int(trail_ids[i])
+                if owner_id == ids[i]:
+                    events.append(("self", entity, None))
+                elif owner_id in by_id:
+                    # The owner of the trail dies, the entity that hit the trail gets the kill score
+                    events.append(("cut", by_id[owner_id], entity))
+
+        # Handle head-on collisions, between the entities sharing a cell, grouped in order of their first member
+        _, inverse, counts = np.unique(xs.astype(np.int64) * self.grid_size + ys, return_inverse=True, return_counts=True)
+        heads = {}
+        for i in np.flatnonzero(counts[inverse] > 1).tolist():
+            heads.setdefault(int(inverse[i]), []).append(entities[i])
+        for group in heads.values():
+            for i, entity1 in enumerate(group):
+                for entity2 in group[i+1:]:
                     entity1_in_territory = entity1.is_in_own_territory()
                     entity2_in_territory = entity2.is_in_own_territory()
 
                     if entity1_in_territory and entity2_in_territory:
                         # Both entities are in their own territory, just block the move
-                        entity1.x, entity1.y = entity1.trail[-2] if len(entity1.trail) > 1 else (entity1.x, entity1.y)
-                        entity2.x, entity2.y = entity2.trail[-2] if len(entity2.trail) > 1 else (entity2.x, entity2.y)
+                        events.append(("blocked", entity1, entity2))
                     elif entity1_in_territory:
                         # Entity1 survives, Entity2 is removed
-                        entities_to_remove.append(entity2)
-                        score_manager.add_kill_score(entity1)
+                        events.append(("head_on", entity2, entity1))
                     elif entity2_in_territory:
                         # Entity2 survives, Entity1 is removed
-                        entities_to_remove.append(entity1)
-                        score_manager.add_kill_score(entity2)
+                        events.append(("head_on", entity1, entity2))
                     else:
-                        # Neither entity is in their own territory, both are removed
-                        entities_to_remove.extend([entity1, entity2])
-                        # print(f"Head-on collision in open space between {entity1.name} and {entity2.name}")
-                        # No score is awarded in this case
-
-        # Remove duplicates from entities_to_remove
-        entities_to_remove = list(set(entities_to_remove))
-
-        # Handle removals and respawns
-        for entity in entities_to_remove:
-            if entity in bots:
-                bots.remove(entity)
-                all_entities.remove(entity)
-                del territories[entity]
-                del score_manager.scores[entity.name]  # Remove the score when the entity is removed
-                new_bot = respawn_bot(entity, all_entities)
-                bots.append(new_bot)
-                all_entities.append(new_bot)
-                territories[new_bot] = new_bot.territory
-                score_manager.initialize_score(new_bot)
-            elif entity == player:
-                print("Player removed! Game over.")
-                running = False
-                break
-
-
-        # In the main game loop, after moving entities and checking collisions
-        for entity in all_entities:
-            score_manager.update_score(entity)
-
-    # -------------------------------------------------------------------------------------------
-    # Update territories
-    for entity in all_entities:
-        if entity.is_in_own_territory():
-            entity.expand_territory()
-        territories[entity] = entity.territory
-    # -------------------------------------------------------------------------------------------------------------------------------------------------------------
-    # Calculate viewport offset
-    # offset_x = max(0, min(player.x - VIEWPORT_TILES // 2, GRID_SIZE - VIEWPORT_TILES - 1))
-    # offset_y = max(0, min(player.y - VIEWPORT_TILES // 2, GRID_SIZE - VIEWPORT_TILES - 1))
-    offset_x = max(1, min(player.x - VIEWPORT_TILES // 2, GRID_SIZE - VIEWPORT_TILES - 1))
-    offset_y = max(1, min(player.y - VIEWPORT_TILES // 2, GRID_SIZE - VIEWPORT_TILES - 1))
-    # -------------------------------------------------------------------------------------------------
-    # Draw everything
-    screen.fill(BACKGROUND_COLOR)
+                        # Neither entity is in their own territory, both are removed; no score is awarded
+                        events.append(("head_on", entity1, None))
+                        events.append(("head_on", entity2, None))
+        return events
+
+    def resolve_collisions(self, events):
+        victims = {}
+        for kind, entity, other in events:
+            if kind == "blocked":
+                for blocked in (entity, other):
+                    blocked.x, blocked.y = blocked.trail[-2] if len(blocked.trail) > 1 else (blocked.x, blocked.y)
+                continue
+            if self.game_over and entity is self.player:
+                continue  # The player is out already; matches that run on after game over (benchmarks) ignore it
+            if other is not None:
+                self.score_manager.add_kill_score(other)
+            victims.setdefault(entity, kind)
+
+        # Handle removals and respawns, in the order the victims were found
+        removed = set()
+        for entity in victims:
+            if entity in self.bots:
+                self.remove_bot(entity)
+                self.respawn_bot(entity)
+                removed.add(entity)
+            elif entity == self.player:
+                print(f"Player removed! Game over. Rank {self.score_manager.rank(entity)} of {len(self.all_entities)}.")
+                self.game_over = True  # The bots found after the player are still removed and respawned
+        return removed
+
+    def remove_bot(self, bot):
+        self.bots.remove(bot)
+        self.all_entities.remove(bot)
+        del self.by_id[bot.id]
+        self.spatial.remove(bot)
+        self.spawn_index.remove(bot)
+        self.ownership.release(bot.id)
+        self.trails.erase(bot.trail, bot.id)
+        self.score_manager.remove(bot)
+        self.entity_store.release(bot.slot)
+        self.home_fields.pop(bot.id, None)
+        bot.slot = None  # Any later use of the dead handle fails instead of reading the slot's next owner
+
+    def respawn_bot(self, dead_bot):
+        new_bot = respawn_bot(self, dead_bot)
+        self.bots.append(new_bot)
+        self.all_entities.append(new_bot)
+        self.by_id[new_bot.id] = new_bot
+        self.spatial.insert(new_bot)
+        self.spawn_index.add(new_bot)
+        self.score_manager.initialize_score(new_bot)
+        return new_bot
+
+
+# Parallel bot decisions --------------------------------------------------------------------------------------------------------------------------------------------
+class WorldSnapshot:
+    # The part of the world Bot.decide_move() reads, as int32 arrays in one shared memory block: the chunked
+    # ownership grid (slots, counts and arena), the tactical trail field with its chunk slots and a table of
+    # entities (ENTITY_COLUMNS). Arena and field are sized for a number of chunks, the pool makes a bigger
+    # block when the world outgrows it. The main process writes it once per tick, copying only the arena
+    # chunks that changed since its last write, and the decision workers map the same block read-only
+    FIELDS = ('trail_dist', 'trail_owner', 'trail_source')
+    ENTITY_COLUMNS = ('id', 'x', 'y', 'is_bot', 'area', 'version')  # area and version of the entity's territory
+    CHUNK_CELLS = CHUNK_SIZE * CHUNK_SIZE
+
+    def __init__(self, grid_size, capacity, chunk_capacity, field_capacity, name=None):
+        self.grid_size = grid_size
+        self.capacity = capacity
+        self.chunk_capacity = chunk_capacity
+        self.field_capacity = field_capacity
+        chunks = -(-grid_size // CHUNK_SIZE)
+        field_cells = field_capacity * self.CHUNK_CELLS
+        columns = len(self.ENTITY_COLUMNS)
+        size = (3 * chunks * chunks + chunk_capacity * self.CHUNK_CELLS + len(self.FIELDS) * 2 * field_cells
+                + capacity * columns) * 4
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.source = None  # The ownership grid last written, whose changed chunks are all that need copying
+        block = np.ndarray(size // 4, dtype=np.int32, buffer=self.shm.buf)
+        offset = 0
+        for part, count, shape in (('owner_slots', chunks * chunks, (chunks, chunks)),
+                                   ('owner_counts', chunks * chunks, (chunks, chunks)),
+                                   ('owner_arena', chunk_capacity * self.CHUNK_CELLS, (chunk_capacity, CHUNK_SIZE, CHUNK_SIZE)),
+                                   ('field_slots', chunks * chunks, (chunks, chunks)),
+                                   *((field, 2 * field_cells, (2, field_cells)) for field in self.FIELDS),
+                                   ('entities', capacity * columns, (capacity, columns))):
+            setattr(self, part, block[offset:offset + count].reshape(shape))
+            offset += count
+
+    def fits(self, sim):
+        return (self.grid_size == sim.grid_size and self.capacity >= len(sim.all_entities)
+                and self.chunk_capacity >= sim.ownership.owner.used and self.field_capacity >= sim.tactical.covered)
+
+    def write(self, sim):
+        owner = sim.ownership.owner
+        self.owner_slots[...] = owner.slots
+        self.owner_counts[...] = owner.counts
+        changed = owner.take_dirty()
+        if owner is self.source:
+            self.owner_arena[changed] = owner.arena[changed]
+        else:  # A new block or another world: copy every chunk
+            self.owner_arena[:owner.used] = owner.arena[:owner.used]
+            self.source = owner
+        tactical = sim.tactical
+        self.field_slots[...] = tactical.slots
+        n = tactical.covered * self.CHUNK_CELLS
+        for name, field in zip(self.FIELDS, tactical.trail_field):
+            getattr(self, name)[:, :n] = field
+        slots = [entity.slot for entity in sim.all_entities]
+        ids = sim.entity_store.column('id')[slots]
+        for i, column in enumerate(('id', 'x', 'y', 'is_bot')):
+            self.entities[:len(slots), i] = sim.entity_store.column(column)[slots]
+        ownership = sim.ownership
+        self.entities[:len(slots), 4] = [ownership.area_by_owner.get(entity_id, 0) for entity_id in ids.tolist()]
+        self.entities[:len(slots), 5] = [ownership.versions.get(entity_id, 0) for entity_id in ids.tolist()]
+
+    def close(self, unlink=False):
+        for name in ('owner_slots', 'owner_counts', 'owner_arena', 'field_slots', 'entities') + self.FIELDS:
+            setattr(self, name, None)
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class WorldView:
+    # Stands in for the Simulation inside a decision worker. Other entities are bare Player / Bot objects
+    # with just an id and a position, which is all a bot looks at
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.grid_size = snapshot.grid_size
+        owner = ChunkedArray.__new__(ChunkedArray)
+        owner.size = snapshot.grid_size
+        owner.chunks = len(snapshot.owner_slots)
+        owner.slots, owner.counts, owner.arena = snapshot.owner_slots, snapshot.owner_counts, snapshot.owner_arena
+        owner.used = snapshot.chunk_capacity
+        self.ownership = OwnershipGrid.__new__(OwnershipGrid)
+        self.ownership.size = snapshot.grid_size
+        self.ownership.owner = owner
+        self.tactical = TacticalField(snapshot.grid_size)
+        self.tactical.slots = snapshot.field_slots
+        self.tactical.trail_field = (snapshot.trail_dist, snapshot.trail_owner, snapshot.trail_source)
+        self.spatial = self.tactical.spatial = SpatialHash()
+        self.entity_store = EntityStore()
+        self.home_fields = {}  # Kept across ticks like the main process's; reused while its territory's version holds
+
+    def load(self, tick_count, entity_count, player_id):
+        self.tick_count = tick_count
+        self.ownership.area_by_owner = {}
+        self.ownership.versions = {}
+        self.all_entities = []
+        self.entity_store.clear()
+        for entity_id, x, y, is_bot, area, version in self.snapshot.entities[:entity_count].tolist():
+            entity = (Bot if is_bot else Player).blank(self)
+            entity.id, entity.x, entity.y = entity_id, x, y
+            if area:
+                self.ownership.area_by_owner[entity_id] = area
+            self.ownership.versions[entity_id] = version
+            self.all_entities.append(entity)
+        self.by_id = {entity.id: entity for entity in self.all_entities}
+        self.player = self.by_id[player_id]
+        self.spatial.rebuild(self.all_entities)
+        for bot_id in [bot_id for bot_id in self.home_fields if bot_id not in self.by_id]:
+            del self.home_fields[bot_id]
+
+
+decision_world = None  # The WorldView of a decision worker process
+
+
+def start_decision_worker(shm_name, grid_size, capacity, chunk_capacity, field_capacity):
+    global decision_world
+    decision_world = WorldView(WorldSnapshot(grid_size, capacity, chunk_capacity, field_capacity, name=shm_name))
+
+
+def decide_bots(tick_info, states):
+    # Runs decide_move() for a chunk of bots; returns each bot's decision and its updated state
+    decision_world.load(*tick_info)
+    results = []
+    for state in states:
+        bot = Bot.blank(decision_world)
+        bot.load_decision_state(state)
+        bot._territory = TerritoryView(decision_world.ownership, bot)
+        bot.rng = random.Random()
+        target = bot.decide_move()
+        state = bot.decision_state()
+        del state['trail']  # decide_move() doesn't touch the trail
+        results.append((target, state))
+    return results
+
+
+class BotDecisionPool:
+    # Runs the bots' decide_move() on a process pool. Bot states go out with the tasks and come back with
+    # the decisions (random generator included), and are applied in bot order, so a match plays out
+    # exactly as it does serially, whatever the number of workers
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.snapshot = None
+
+    def ensure_capacity(self, sim):
+        if self.snapshot and self.snapshot.fits(sim):
+            return
+        # Leave room to grow, so the block (and with it the pool) is rarely rebuilt
+        self.close()
+        chunks = sim.ownership.owner.chunks ** 2
+        snapshot = self.snapshot = WorldSnapshot(sim.grid_size, max(64, 2 * len(sim.all_entities)),
+                                                 min(chunks, max(16, 2 * sim.ownership.owner.used)),
+                                                 min(chunks, max(16, 2 * sim.tactical.covered)))
+        self.executor = ProcessPoolExecutor(self.workers, initializer=start_decision_worker,
+                                            initargs=(snapshot.shm.name, sim.grid_size, snapshot.capacity,
+                                                      snapshot.chunk_capacity, snapshot.field_capacity))
+
+    def decide(self, sim):
+        self.ensure_capacity(sim)
+        self.snapshot.write(sim)
+        tick_info = (sim.tick_count, len(sim.all_entities), sim.player.id)  # The rest is in the snapshot
+        bots = sim.bots
+        chunk = max(1, -(-len(bots) // (self.workers * 4)))
+        futures = [self.executor.submit(decide_bots, tick_info, [bot.decision_state() for bot in bots[i:i + chunk]])
+                   for i in range(0, len(bots), chunk)]
+        targets = []
+        bot_index = 0
+        for future in futures:
+            for target, state in future.result():
+                bots[bot_index].load_decision_state(state)
+                targets.append(target)
+                bot_index += 1
+        return targets
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.snapshot is not None:
+            self.snapshot.close(unlink=True)
+            self.snapshot = None
+
+
+# Profiling ---------------------------------------------------------------------------------------------------------------------------------------------------------
+class Profiler(PhaseTimer):
+    # Rolling timings of the tick phases, the window's own phases and the heavy bot methods. While disabled it
+    # costs nothing: step() only checks sim.phase_timer, and the method wrappers are only installed while enabled.
+    # Methods are hooked on their class, functions on this module; a hooked constructor shows as its class
+    HOOKED_METHODS = [(Bot, 'find_best_path'), (Bot, 'return_to_territory'), (Bot, 'path_to_target'),
+                      (sys.modules[__name__], 'astar_path'), (HomeField, '__init__'), (Player, 'fill_interior')]
+    HISTOGRAM_EDGES_MS = [0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, float('inf')]
+
+    def __init__(self, window=PROFILE_WINDOW):
+        super().__init__()
+        self.window = window
+        self.enabled = False
+        self.sim = None
+        self.originals = {}
+
+    def attach(self, sim):
+        if self.sim is not None:
+            self.sim.phase_timer = None
+        self.sim = sim
+        sim.phase_timer = self if self.enabled else None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.start()
+        for owner, name in self.HOOKED_METHODS:
+            self.originals[(owner, name)] = owner.__dict__[name]
+            setattr(owner, name, self.timed(owner.__name__ if name == '__init__' else name, owner.__dict__[name]))
+        if self.sim is not None:
+            self.sim.phase_timer = self
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for (owner, name), original in self.originals.items():
+            setattr(owner, name, original)
+        self.originals.clear()
+        if self.sim is not None:
+            self.sim.phase_timer = None
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def timed(self, label, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(label, time.perf_counter() - start)
+        return wrapper
+
+    def record(self, phase, seconds):
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def stats(self):
+        # name -> summary of the samples in the window, times in ms
+        table = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000.0
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            counts, _ = np.histogram(ms, self.HISTOGRAM_EDGES_MS)
+            table[name] = {'count': len(ms), 'mean_ms': float(ms.mean()), 'p50_ms': float(p50),
+                           'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(ms.max()),
+                           'histogram': counts.tolist()}
+        return table
+
+    def export(self, filename):
+        # CSV if the file name ends in .csv, JSON otherwise
+        table = self.stats()
+        with open(filename, 'w') as f:
+            if filename.endswith('.csv'):
+                bins = [f"le_{edge}ms" for edge in self.HISTOGRAM_EDGES_MS[1:]]
+                f.write(','.join(['name', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'] + bins) + '\n')
+                for name, row in table.items():
+                    values = [row[key] for key in ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+                    f.write(','.join([name] + [f"{value:.4f}" if isinstance(value, float) else str(value)
+                                               for value in values] + [str(c) for c in row['histogram']]) + '\n')
+            else:
+                json.dump({'window': self.window, 'histogram_edges_ms': self.HISTOGRAM_EDGES_MS[1:-1],
+                           'timings': table}, f, indent=2)
+        print(f"Profile written to {filename}")
 
-    # Draw viewport
-    viewport = pygame.Surface((VIEWPORT_SIZE, VIEWPORT_SIZE))
 
-    # 1. Draw the dark grey background
-    viewport.fill(BACKGROUND_COLOR)
+profiler_hud_time = 0
+cached_profiler_hud = None
 
-    # 2. Draw all territories
-    for entity, territory in territories.items():
-        for x, y in territory:
-            if offset_x <= x < offset_x + VIEWPORT_TILES and offset_y <= y < offset_y + VIEWPORT_TILES:
-                pygame.draw.rect(viewport, entity.color, ((x - offset_x) * TILE_SIZE, (y - offset_y) * TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
-    # 3. Draw the black grid-lines
-    for i in range(VIEWPORT_TILES + 1):
-        pygame.draw.line(viewport, GRID_COLOR, (i * TILE_SIZE, 0), (i * TILE_SIZE, VIEWPORT_SIZE - 1))
-        pygame.draw.line(viewport, GRID_COLOR, (0, i * TILE_SIZE), (VIEWPORT_SIZE - 1, i * TILE_SIZE))
+def draw_profiler_hud(screen, profiler):
+    # Overlay on the radar: p50 / p99 per phase, and a bar of the p99 against one tick's time budget
+    global profiler_hud_time, cached_profiler_hud
+    current_time = time.time()
+    if cached_profiler_hud is None or current_time - profiler_hud_time > PROFILE_HUD_REFRESH:
+        profiler_hud_time = current_time
+        font = pygame.font.Font(None, 18)
+        table = profiler.stats()
+        line_height = 15
+        width = SHRUNKEN_RADAR_SIZE
+        cached_profiler_hud = pygame.Surface((width, (len(table) + 1) * line_height + 6), pygame.SRCALPHA)
+        cached_profiler_hud.fill((0, 0, 0, 190))
+        columns = (4, 120, 160)
+        for x, title in zip(columns, ("phase", "p50", "p99 ms")):
+            cached_profiler_hud.blit(font.render(title, True, (255, 255, 255)), (x, 3))
+        budget_ms = 1000.0 / TICK_RATE
+        for i, (name, row) in enumerate(table.items()):
+            y = 3 + (i + 1) * line_height
+            bar = min(1.0, row['p99_ms'] / budget_ms)
+            bar_color = (0, 160, 0) if bar < 0.5 else (200, 160, 0) if bar < 1.0 else (200, 0, 0)
+            pygame.draw.rect(cached_profiler_hud, bar_color, (width - 44, y + 3, max(1, int(40 * bar)), 8))
+            for x, text in zip(columns, (name, f"{row['p50_ms']:.2f}", f"{row['p99_ms']:.2f}")):
+                cached_profiler_hud.blit(font.render(text, True, (220, 220, 220)), (x, y))
+    screen.blit(cached_profiler_hud, (VIEWPORT_SIZE + RADAR_SHRINK, 0))
+
+
+# Recording -------------------------------------------------------------------------------------------------------------------------------------------------------
+def state_digest(sim):
+    # Cheap fingerprint of the final state, to tell whether a replay still ends up where the recording did
+    digest = zlib.crc32(sim.ownership.owner.to_dense().tobytes())
+    return zlib.crc32(sim.trails.owner.to_dense().tobytes(), digest)
+
+
+def save_recording(sim, filename):
+    if sim.input_log is None:
+        print("Not recording: a loaded game can't be replayed from its seed.")
+        return
+    recording = {
+        'version': RECORDING_VERSION,
+        'seed': sim.seed,
+        'grid_size': sim.grid_size,
+        'num_bots': sim.num_bots,
+        'ticks': sim.tick_count,
+        'inputs': sim.input_log,
+        'digest': state_digest(sim),
+    }
+    with open(filename, 'w') as f:
+        json.dump(recording, f, separators=(',', ':'))
+    print(f"Recorded {sim.tick_count} ticks and {len(sim.input_log)} inputs to {filename}")
 
-    # 4. Draw the trails for all entities (player and bots)
-    for entity in all_entities:
-        trail_color = TRAIL_COLOR if entity == player else entity.color
-        for x, y in entity.trail:
-            if offset_x <= x < offset_x + VIEWPORT_TILES and offset_y <= y < offset_y + VIEWPORT_TILES:
-                pygame.draw.rect(viewport, trail_color, ((x - offset_x) * TILE_SIZE, (y - offset_y) * TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
-    # 5. Draw all entities (player and bots)
-    for entity in all_entities:
-        entity.draw(viewport, offset_x, offset_y)
-    # --------------------------------------------------------------
-    # Draw viewport & borders on main screen
-    screen.blit(viewport, (0, 0))
+def replay_recording(filename, decision_pool=None):
+    # Re-run a recorded match without a window, as fast as possible
+    with open(filename) as f:
+        recording = json.load(f)
+    if recording.get('version') != RECORDING_VERSION:
+        print(f"Unsupported recording version {recording.get('version')}")
+        return None
 
-    draw_viewport_border(screen, offset_x, offset_y)
-    # ----------------------------------------------------------------------------------------------------------------------------------------------------
-    draw_radar(screen, territories)
-    # screen.blit(radar, (VIEWPORT_SIZE, 0))
+    decode = {code: player_input for player_input, code in INPUT_CODES.items()}
+    inputs = {}
+    for tick, code in recording['inputs']:
+        inputs.setdefault(tick, []).append(decode[code])
+
+    sim = Simulation(recording['grid_size'], recording['num_bots'], seed=recording['seed'])
+    sim.decision_pool = decision_pool
+    start_time = time.perf_counter()
+    for tick in range(recording['ticks']):
+        for player_input in inputs.get(tick, ()):
+            sim.apply_player_input(player_input)
+        sim.step()
+    elapsed = time.perf_counter() - start_time
+
+    ticks = recording['ticks']
+    print(f"Replayed {ticks} ticks in {elapsed:.2f}s ({ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+    if state_digest(sim) == recording['digest']:
+        print("Final state matches the recording.")
+    else:
+        print("Final state differs from the recording (game logic changed since it was made).")
+    return sim
+
+
+# Window ----------------------------------------------------------------------------------------------------------------------------------------------------------
+class ViewportRenderer:
+    # Pre-renders the map one chunk at a time (territory, grid lines and trails) onto surfaces kept in a
+    # small LRU cache, so only the chunks around the viewport are ever drawn. Cached chunks are patched
+    # from the ownership and trail change logs; chunks that are empty in both grids share one surface
+    def __init__(self, sim, max_cached_chunks=MAX_CACHED_CHUNKS):
+        self.sim = sim
+        self.max_cached_chunks = max_cached_chunks
+        self.cache = OrderedDict()
+        side = CHUNK_SIZE * TILE_SIZE
+        self.empty = pygame.Surface((side, side))
+        self.empty.fill(BACKGROUND_COLOR)
+        for line in range(0, side, TILE_SIZE):
+            self.empty.fill(GRID_COLOR, (line, 0, 1, side))
+            self.empty.fill(GRID_COLOR, (0, line, side, 1))
+
+    def color_tables(self):
+        # Territory and trail color per owner id; unknown ids fall back to the background
+        top = max([self.sim.ownership.owner.max(), self.sim.trails.owner.max()] + list(self.sim.by_id)) + 1
+        territory = np.tile(np.array(BACKGROUND_COLOR, dtype=np.uint8), (top, 1))
+        trail = territory.copy()
+        for entity in self.sim.all_entities:
+            territory[entity.id] = entity.color
+            trail[entity.id] = TRAIL_COLOR if entity == self.sim.player else entity.color
+        return territory, trail
+
+    def render_chunk(self, cx, cy, tables):
+        territory, trail = tables
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        x1, y1 = min(x0 + CHUNK_SIZE, self.sim.grid_size), min(y0 + CHUNK_SIZE, self.sim.grid_size)
+        owner = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int32)
+        trail_owner = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int32)
+        owner[:x1 - x0, :y1 - y0] = self.sim.ownership.owner.region(x0, y0, x1, y1)
+        trail_owner[:x1 - x0, :y1 - y0] = self.sim.trails.owner.region(x0, y0, x1, y1)
+        on_trail = trail_owner != 0
+        colors = np.where(on_trail[..., None], trail[trail_owner], territory[owner])
+        pixels = colors.repeat(TILE_SIZE, axis=0).repeat(TILE_SIZE, axis=1)
+        # Every tile carries its own top and left grid line, trails are drawn over them
+        edge = np.arange(pixels.shape[0]) % TILE_SIZE == 0
+        lines = (edge[:, None] | edge[None, :]) & ~on_trail.repeat(TILE_SIZE, axis=0).repeat(TILE_SIZE, axis=1)
+        pixels[lines] = GRID_COLOR
+        surface = pygame.Surface(pixels.shape[:2])
+        pygame.surfarray.blit_array(surface, pixels)
+        return surface
+
+    def chunk_surface(self, cx, cy, tables):
+        key = (cx, cy)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if not self.sim.ownership.owner.counts[key] and not self.sim.trails.owner.counts[key]:
+            return self.empty
+        surface = self.cache[key] = self.render_chunk(cx, cy, tables)
+        if len(self.cache) > self.max_cached_chunks:
+            self.cache.popitem(last=False)
+        return surface
+
+    def redraw_cells(self, xs, ys):
+        ownership, trails = self.sim.ownership, self.sim.trails
+        colors = {entity.id: entity.color for entity in self.sim.all_entities}
+        for x, y, owner, trail_id in zip(xs.tolist(), ys.tolist(), ownership.owner.take(xs, ys).tolist(),
+                                         trails.owner.take(xs, ys).tolist()):
+            surface = self.cache.get((x >> CHUNK_BITS, y >> CHUNK_BITS))
+            if surface is None:
+                continue
+            px, py = (x & CHUNK_MASK) * TILE_SIZE, (y & CHUNK_MASK) * TILE_SIZE
+            if trail_id:
+                color = TRAIL_COLOR if trail_id == self.sim.player.id else colors.get(trail_id, BACKGROUND_COLOR)
+                surface.fill(color, (px, py, TILE_SIZE, TILE_SIZE))
+                continue
+            surface.fill(colors.get(owner, BACKGROUND_COLOR), (px, py, TILE_SIZE, TILE_SIZE))
+            surface.fill(GRID_COLOR, (px, py, TILE_SIZE, 1))
+            surface.fill(GRID_COLOR, (px, py, 1, TILE_SIZE))
+
+    def update(self):
+        owned, trailed = self.sim.ownership.changes.take(), self.sim.trails.changes.take()
+        if owned is None or trailed is None:
+            self.cache.clear()
+            return
+        if not self.cache:
+            return
+        xs, ys = np.concatenate([owned[0], trailed[0]]), np.concatenate([owned[1], trailed[1]])
+        if len(xs):
+            xs, ys = np.unique(np.stack([xs, ys], axis=1), axis=0).T
+            self.redraw_cells(xs, ys)
+
+    def draw(self, screen, offset_x, offset_y):
+        self.update()
+        screen.set_clip((0, 0, VIEWPORT_SIZE, VIEWPORT_SIZE))
+        tables = None
+        last_x = min(offset_x + VIEWPORT_TILES, self.sim.grid_size) - 1
+        last_y = min(offset_y + VIEWPORT_TILES, self.sim.grid_size) - 1
+        for cx in range(offset_x >> CHUNK_BITS, (last_x >> CHUNK_BITS) + 1):
+            for cy in range(offset_y >> CHUNK_BITS, (last_y >> CHUNK_BITS) + 1):
+                if tables is None and (cx, cy) not in self.cache:
+                    tables = self.color_tables()
+                surface = self.chunk_surface(cx, cy, tables)
+                screen.blit(surface, ((cx * CHUNK_SIZE - offset_x) * TILE_SIZE, (cy * CHUNK_SIZE - offset_y) * TILE_SIZE))
+
+        # Entity heads go straight onto the screen, clipped to the viewport
+        for entity in self.sim.all_entities:
+            if offset_x <= entity.x <= last_x and offset_y <= entity.y <= last_y:
+                entity.draw(screen, offset_x, offset_y)
+        screen.set_clip(None)
+
+
+def draw_frame(screen, renderer, radar, game_started, profiler=None):
+    sim = renderer.sim
+    player = sim.player
+    # Calculate viewport offset
+    offset_x = max(1, min(player.x - VIEWPORT_TILES // 2, sim.grid_size - VIEWPORT_TILES - 1))
+    offset_y = max(1, min(player.y - VIEWPORT_TILES // 2, sim.grid_size - VIEWPORT_TILES - 1))
 
-    draw_score_table(screen, score_manager, all_entities)
+    # Draw everything
+    screen.fill(BACKGROUND_COLOR)
+    renderer.draw(screen, offset_x, offset_y)
+    draw_viewport_border(screen, offset_x, offset_y, sim.grid_size)
+    radar.draw(screen)
+    draw_score_table(screen, sim.score_manager)
+    if profiler is not None and profiler.enabled:
+        draw_profiler_hud(screen, profiler)
 
     if not game_started:
         font = pygame.font.Font(None, 36)
@@ -1395,11 +3253,238 @@ while running:
         text_rect = text.get_rect(center=(WINDOW_WIDTH//2, WINDOW_HEIGHT//2))
         screen.blit(text, text_rect)
 
-
     pygame.display.flip()
-    # clock.tick(10)  # Limit to 10 FPS for easier testing
-    clock.tick(30)
 
-pygame.quit()
+
+ARROW_DIRECTIONS = {
+    pygame.K_UP: (0, -1),
+    pygame.K_DOWN: (0, 1),
+    pygame.K_LEFT: (-1, 0),
+    pygame.K_RIGHT: (1, 0),
+}
+
+
+class TickScheduler:
+    # Fixed timestep: wall time is accumulated and paid out in whole ticks of 1 / tick_rate seconds,
+    # so the game runs at the same speed whatever a frame costs to draw
+    def __init__(self, tick_rate=TICK_RATE, max_catch_up_time=MAX_CATCH_UP_TIME, max_backlog=MAX_TICK_BACKLOG):
+        self.tick_time = 1.0 / tick_rate
+        self.max_catch_up_time = max_catch_up_time
+        self.max_backlog = max_backlog
+        self.accumulator = 0.0
+        self.last_time = None
+
+    def reset(self):
+        # Forget the time spent paused, loading, etc.
+        self.accumulator = 0.0
+        self.last_time = None
+
+    def run(self, step):
+        # Call step() for every tick that is due, for at most max_catch_up_time of wall time.
+        # Returns the number of ticks run, and stops early when step() returns False
+        now = time.perf_counter()
+        if self.last_time is not None:
+            self.accumulator = min(self.accumulator + now - self.last_time, self.max_backlog)
+        self.last_time = now
+
+        ticks = 0
+        while self.accumulator >= self.tick_time:
+            self.accumulator -= self.tick_time
+            ticks += 1
+            if not step():
+                break
+            if time.perf_counter() - now > self.max_catch_up_time:
+                break
+        return ticks
+
+    def behind(self):
+        return self.accumulator >= self.tick_time
+
+
+def run_window(sim, tick_rate=TICK_RATE, frame_rate=FRAME_RATE,
+               radar_refresh=RADAR_REFRESH_FRAMES, radar_colors=RADAR_OWNER_COLORS, profile=None,
+               autosave=AUTOSAVE_INTERVAL):
+    # Initialize Pygame
+    pygame.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+    pygame.display.set_caption("YASC - Yet Another Splix Clone v1.0")
+
+    game_started = False
+    game_paused = False
+    running = True
+    clock = pygame.time.Clock()
+    scheduler = TickScheduler(tick_rate)
+    skipped_frames = 0
+    player_input = None
+    renderer = ViewportRenderer(sim)
+    radar = RadarRenderer(sim, radar_refresh, radar_colors)
+    # F3 toggles the profiler and its overlay, F4 exports it; --profile FILE starts it on and exports at exit
+    profiler = Profiler()
+    profiler.attach(sim)
+    if profile:
+        profiler.enable()
+    # 'S' and the autosave both write on a background thread, so neither shows up as a hitch
+    saver = BackgroundSaver(AUTOSAVE_FILE, autosave * tick_rate)
+
+    def step():
+        nonlocal player_input, running
+        # Input is applied by the first tick that runs after it arrived
+        running = sim.step(player_input) and running
+        player_input = None
+        saver.update(sim)
+        return running
+
+    while running:
+        if profiler.enabled:
+            profiler.start()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key in ARROW_DIRECTIONS:
+                    if game_paused:
+                        game_paused = False
+                        print("Game resumed!")
+                    elif not game_started:
+                        game_started = True
+                        print("Game started!")
+                    player_input = ARROW_DIRECTIONS[event.key]
+                elif event.key == pygame.K_p:
+                    player_input = PLAYER_STOP
+                elif event.key == pygame.K_F3:
+                    profiler.toggle()
+                elif event.key == pygame.K_F4:
+                    profiler.export(profile or "profile.json")
+                elif event.key == pygame.K_h:
+                    game_paused = not game_paused
+                    if game_paused:
+                        print("Game paused. Press any arrow key to resume.")
+                    else:
+                        print("Game resumed!")
+                elif event.key == pygame.K_s:
+                    game_paused = True
+                    saver.save(sim, SAVE_FILE)
+                    print("Game paused. Press any arrow key to resume.")
+                elif event.key == pygame.K_l:
+                    saver.wait()
+                    loaded_sim = load_game()
+                    if loaded_sim:
+                        loaded_sim.decision_pool = sim.decision_pool
+                        sim = loaded_sim
+                        renderer = ViewportRenderer(sim)
+                        radar = RadarRenderer(sim, radar_refresh, radar_colors)
+                        profiler.attach(sim)
+                        player_input = None
+                        game_started = True
+                        game_paused = True
+                        print("Game loaded and paused. Press any arrow key to resume.")
+
+        if profiler.enabled:
+            profiler.lap("events")
+
+        if not game_paused and game_started:
+            scheduler.run(step)
+        else:
+            if player_input is not None:
+                sim.apply_player_input(player_input)
+                player_input = None
+            scheduler.reset()
+
+        # Skip drawing while the simulation is catching up, but never for too long
+        if scheduler.behind() and skipped_frames < MAX_SKIPPED_FRAMES:
+            skipped_frames += 1
+        else:
+            skipped_frames = 0
+            if profiler.enabled:
+                profiler.start()
+            draw_frame(screen, renderer, radar, game_started, profiler)
+            if profiler.enabled:
+                profiler.lap("render")
+        clock.tick(frame_rate)
+
+    if profile:
+        profiler.export(profile)
+    profiler.disable()
+    saver.wait()
+    pygame.quit()
+    return sim
+
+
+def run_headless(sim, ticks, profile=None):
+    profiler = Profiler(window=max(ticks, PROFILE_WINDOW))
+    profiler.attach(sim)
+    if profile:
+        profiler.enable()
+    start_time = time.perf_counter()
+    steps = 0
+    while steps < ticks and sim.step():
+        steps += 1
+    elapsed = time.perf_counter() - start_time
+    print(f"{steps} ticks in {elapsed:.2f}s ({steps / max(elapsed, 1e-9):.0f} ticks/s)")
+    if profile:
+        profiler.export(profile)
+        profiler.disable()
+
+
+def seed_type(text):
+    # Seeds are saved as unsigned 64-bit numbers
+    seed = int(text)
+    if not 0 <= seed < 2 ** 64:
+        raise argparse.ArgumentTypeError(f"seed must be between 0 and {2 ** 64 - 1}")
+    return seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YASC - Yet Another Splix Clone")
+    parser.add_argument("--headless", type=int, metavar="TICKS",
+                        help="run TICKS simulation steps without opening a window")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, metavar="TPS",
+                        help="simulation ticks per second (default: %(default)s)")
+    parser.add_argument("--fps", type=int, default=FRAME_RATE,
+                        help="render frame rate cap (default: %(default)s)")
+    parser.add_argument("--radar-refresh", type=int, default=RADAR_REFRESH_FRAMES, metavar="FRAMES",
+                        help="rebuild the radar every FRAMES frames (default: %(default)s)")
+    parser.add_argument("--radar-colors", action="store_true", default=RADAR_OWNER_COLORS,
+                        help="draw each entity's territory in its own color on the radar")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="start with the profiler on and export it to FILE (.csv or .json) on exit")
+    parser.add_argument("--grid-size", type=int, default=GRID_SIZE, metavar="CELLS",
+                        help="side of the map in cells, e.g. 2000 for a large world (default: %(default)s)")
+    parser.add_argument("--bots", type=int, default=NUM_BOTS, help="number of bots (default: %(default)s)")
+    parser.add_argument("--seed", type=seed_type, help="seed for a reproducible match")
+    parser.add_argument("--autosave", type=int, default=AUTOSAVE_INTERVAL, metavar="SECONDS",
+                        help=f"save to {AUTOSAVE_FILE} every SECONDS of game time, 0 to turn off (default: %(default)s)")
+    parser.add_argument("--load", metavar="FILE", help="continue a saved game, e.g. " + AUTOSAVE_FILE)
+    parser.add_argument("--record", metavar="FILE", help="write the seed and the player's inputs to FILE on exit")
+    parser.add_argument("--replay", metavar="FILE", help="re-run a recorded match headless at full speed")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="worker processes for the bots' decisions (default: 0, decide on the main thread)")
+    args = parser.parse_args()
+
+    decision_pool = BotDecisionPool(args.workers) if args.workers > 0 else None
+    try:
+        if args.replay:
+            replay_recording(args.replay, decision_pool)
+            return
+
+        sim = load_game(args.load) if args.load else Simulation(args.grid_size, args.bots, seed=args.seed)
+        if sim is None:
+            return
+        sim.decision_pool = decision_pool
+        if args.headless is not None:
+            run_headless(sim, args.headless, args.profile)
+        else:
+            sim = run_window(sim, args.tick_rate, args.fps, args.radar_refresh, args.radar_colors, args.profile,
+                             args.autosave)
+        if args.record:
+            save_recording(sim, args.record)
+    finally:
+        if decision_pool is not None:
+            decision_pool.close()
 
 
+if __name__ == "__main__":
+    main()
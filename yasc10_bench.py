@@ -0,0 +1,214 @@
+# YASC benchmark suite
+#
+# Runs scripted, seeded matches over a range of map sizes and bot counts and writes the results as JSON, so two
+# builds can be compared run against run:
+#   python yasc10_bench.py                               # all default scenarios
+#   python yasc10_bench.py --scenarios 121x40,250x160    # GRIDxBOTS
+#   python yasc10_bench.py --quick --out before.json
+#
+# For every scenario it reports ticks/s and p50/p99 tick latency per phase of Simulation.step() (plus rendering
+# the viewport and radar off-screen), then microbenchmarks of the hot functions.
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import pygame
+
+import yasc10
+from yasc10 import (Simulation, PhaseTimer, Player, Trail, ViewportRenderer, RadarRenderer, BotDecisionPool,
+                    astar_path, find_valid_spawn_position)
+
+
+DEFAULT_SCENARIOS = [(121, 40), (250, 160), (500, 500), (1000, 2000), (2000, 2000)]
+QUICK_SCENARIOS = [(121, 40), (250, 160)]
+DEFAULT_TICKS = 200
+DEFAULT_SEED = 1
+PLAYER_SCRIPT = [(1, 0), (0, 1), (-1, 0), (0, -1)]  # The player drives squares of side PLAYER_LEG
+PLAYER_LEG = 8
+
+
+def summarize(samples):
+    # Latency summary of a list of durations in seconds, in milliseconds
+    if not samples:
+        return None
+    ms = np.array(samples) * 1000.0
+    p50, p99 = np.percentile(ms, [50, 99])
+    return {'count': len(ms), 'mean_ms': round(float(ms.mean()), 4), 'p50_ms': round(float(p50), 4),
+            'p99_ms': round(float(p99), 4), 'max_ms': round(float(ms.max()), 4)}
+
+
+def scripted_input(tick):
+    if tick == 0:
+        return PLAYER_SCRIPT[0]
+    if tick % PLAYER_LEG == 0:
+        return PLAYER_SCRIPT[(tick // PLAYER_LEG) % len(PLAYER_SCRIPT)]
+    return None
+
+
+def run_scenario(grid_size, num_bots, ticks, seed, render=True, max_seconds=None, decision_pool=None):
+    setup_start = time.perf_counter()
+    sim = Simulation(grid_size, num_bots, seed=seed)
+    sim.decision_pool = decision_pool
+    setup_time = time.perf_counter() - setup_start
+
+    timer = PhaseTimer()
+    sim.phase_timer = timer
+    if render:
+        screen = pygame.Surface((yasc10.WINDOW_WIDTH, yasc10.WINDOW_HEIGHT))
+        renderer = ViewportRenderer(sim)
+        radar = RadarRenderer(sim, refresh_frames=1)
+
+    tick_times = []
+    start_time = time.perf_counter()
+    for tick in range(ticks):
+        tick_start = time.perf_counter()
+        sim.step(scripted_input(tick))  # The match goes on after the player dies, the bots carry the load
+        if render:
+            player = sim.player
+            offset_x = max(1, min(player.x - yasc10.VIEWPORT_TILES // 2, grid_size - yasc10.VIEWPORT_TILES - 1))
+            offset_y = max(1, min(player.y - yasc10.VIEWPORT_TILES // 2, grid_size - yasc10.VIEWPORT_TILES - 1))
+            render_start = time.perf_counter()
+            renderer.draw(screen, offset_x, offset_y)
+            radar.draw(screen)
+            timer.samples.setdefault('render', []).append(time.perf_counter() - render_start)
+        tick_times.append(time.perf_counter() - tick_start)
+        if max_seconds is not None and time.perf_counter() - start_time > max_seconds:
+            break
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        'name': f"{grid_size}x{num_bots}",
+        'grid_size': grid_size,
+        'bots': num_bots,
+        'seed': seed,
+        'workers': decision_pool.workers if decision_pool else 0,
+        'ticks': len(tick_times),
+        'setup_s': round(setup_time, 4),
+        'elapsed_s': round(elapsed, 4),
+        'ticks_per_sec': round(len(tick_times) / max(elapsed, 1e-9), 2),
+        'tick': summarize(tick_times),
+        'phases': {phase: summarize(samples) for phase, samples in timer.samples.items()},
+        'render': 'measured' if render else 'skipped',
+        'final_entities': len(sim.all_entities),
+        'digest': yasc10.state_digest(sim),
+    }
+
+
+def time_calls(function, arguments):
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def ring(x0, y0, side):
+    # Closed square trail with its top-left corner at (x0, y0)
+    cells = [(x0 + i, y0) for i in range(side)]
+    cells += [(x0 + side - 1, y0 + i) for i in range(1, side)]
+    cells += [(x0 + side - 1 - i, y0 + side - 1) for i in range(1, side)]
+    cells += [(x0, y0 + side - 1 - i) for i in range(1, side - 1)]
+    return cells
+
+
+def run_microbenchmarks(seed, repeat):
+    sim = Simulation(seed=seed)
+    for tick in range(50):
+        sim.step()
+    rng = random.Random(seed)
+    results = {}
+
+    # fill_interior on closed square trails of growing size, away from any territory of the probe
+    probe = Player(sim, sim.grid_size // 2, sim.grid_size // 2, (0, 0, 0))
+    sim.ownership.release(probe.id)
+    for side in (10, 40, 100):
+        side = min(side, sim.grid_size - 4)
+        probe.trail = Trail(ring(2, 2, side))
+        results[f'fill_interior_ring{side}'] = time_calls(probe.fill_interior, [()] * repeat)
+    probe.trail = Trail()
+
+    # astar_path from live bots to random cells
+    bots = sim.bots
+    cases = []
+    for i in range(repeat):
+        bot = bots[i % len(bots)]
+        target = (rng.randrange(1, sim.grid_size - 1), rng.randrange(1, sim.grid_size - 1))
+        cases.append((bot, target))
+    results['astar_path'] = time_calls(lambda bot, target: astar_path((bot.x, bot.y), target, bot.is_safe_move), cases)
+
+    # Bot.path_to_target chasing a target that moves a tile every other call, as the player does, so the
+    # path cache gets its share of hits
+    bot, (target_x, target_y) = cases[0]
+    chase = [(bot, (1 + (target_x + i // 2) % (sim.grid_size - 2), target_y)) for i in range(repeat)]
+    results['path_to_target'] = time_calls(lambda bot, target: bot.path_to_target(target, 'player'), chase)
+
+    results['find_valid_spawn_position'] = time_calls(find_valid_spawn_position, [(sim,)] * repeat)
+    return results
+
+
+def parse_scenarios(text):
+    scenarios = []
+    for item in text.split(','):
+        grid_size, num_bots = item.lower().split('x')
+        scenarios.append((int(grid_size), int(num_bots)))
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YASC scaling benchmarks")
+    parser.add_argument("--scenarios", type=parse_scenarios, metavar="GRIDxBOTS,...",
+                        help="scenarios to run, e.g. 121x40,1000x2000")
+    parser.add_argument("--quick", action="store_true", help="only the small scenarios and fewer calls")
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS, help="ticks per scenario (default: %(default)s)")
+    parser.add_argument("--max-seconds", type=float, help="stop a scenario early after this much wall time")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="match seed (default: %(default)s)")
+    parser.add_argument("--no-render", action="store_true", help="don't time the off-screen rendering")
+    parser.add_argument("--no-micro", action="store_true", help="skip the microbenchmarks")
+    parser.add_argument("--workers", type=int, default=0, help="decide the bots' moves on this many processes")
+    parser.add_argument("--out", default="yasc10_bench.json", help="JSON results file (default: %(default)s)")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios or (QUICK_SCENARIOS if args.quick else DEFAULT_SCENARIOS)
+    results = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scenarios': [],
+    }
+
+    decision_pool = BotDecisionPool(args.workers) if args.workers > 0 else None
+    try:
+        for grid_size, num_bots in scenarios:
+            print(f"{grid_size}x{num_bots}: ", end='', flush=True)
+            result = run_scenario(grid_size, num_bots, args.ticks, args.seed, not args.no_render, args.max_seconds,
+                                  decision_pool)
+            results['scenarios'].append(result)
+            phases = ', '.join(f"{phase} {stats['p50_ms']:.2f}/{stats['p99_ms']:.2f}"
+                               for phase, stats in result['phases'].items())
+            print(f"{result['ticks_per_sec']:.1f} ticks/s  (p50/p99 ms: {phases})")
+    finally:
+        if decision_pool is not None:
+            decision_pool.close()
+
+    if not args.no_micro:
+        results['micro'] = run_microbenchmarks(args.seed, 20 if args.quick else 100)
+        for name, stats in results['micro'].items():
+            print(f"{name}: p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms")
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()